@@ -0,0 +1,48 @@
+import argparse
+import importlib
+import sys
+
+# Entry point of the repository, every tool behind one command:
+#   python . batch --beta 0.5 0.8 --seed 0 1 2 -o results.csv
+#   python . ensemble --replicas 200
+#   python . show --n-agents 100
+# (or python path/to/repository COMMAND ...). A command only imports its
+# own module: nothing is computed at import time and matplotlib is only
+# loaded by the commands drawing something.
+
+COMMANDS = {
+    # name: (module, function, description)
+    "batch": ("batch", "main", "parameter sweep, one CSV row per run"),
+    "ensemble": ("ensemble", "main", "statistics over replicas of one room"),
+    "parallel": ("parallel", "main", "one large room over several processes"),
+    "benchmark": ("benchmark", "main_cli", "timing of update_cells"),
+    "layout": ("layout", "main", "compile a text map or an image to .npz"),
+    "monitor": ("monitor", "main", "run a room and watch it in a browser"),
+    "show": ("__main__", "show", "run a room in a matplotlib window"),
+}
+
+
+def show(argv=None):
+    parser = argparse.ArgumentParser(description="Run a room in a matplotlib window.")
+    parser.add_argument("--n-agents", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=1000)
+    args = parser.parse_args(argv)
+    from evac import test_model
+    test_model(args.ticks, args.n_agents)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print("usage: python . COMMAND [options]\n")
+        for name, (_, _, description) in COMMANDS.items():
+            print("  %-10s %s" % (name, description))
+        return 0 if not argv or argv[0] in ("-h", "--help") else 2
+    module, function, _ = COMMANDS[argv[0]]
+    sys.argv[0] = argv[0]
+    getattr(importlib.import_module(module), function)(argv[1:])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
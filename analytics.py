@@ -0,0 +1,174 @@
+import math
+
+import numpy as np
+
+from evac import RoomListener
+
+# Flow and density measures accumulated while the room runs, in storage
+# that does not depend on the length of the run:
+#   stats = FlowStats()
+#   stats.attach(room)  # after populate, the agents present are followed
+#   while room.scheduler:
+#       room.update_cells()
+#   stats.summary()
+# - exits, distance walked and agent-time (integral of the number of agents
+#   in the room) per time window, in a Series: flow = exits/width, density
+#   = agent_time/width and speed = distance/agent_time of every window give
+#   the points of a fundamental diagram;
+# - time each cell was occupied (occupancy heatmap);
+# - conflicts and mu refusals per cell, refusals within `near_exit` cells
+#   of an exit counted apart (clogging);
+# - evacuation time of every agent, counted from attach.
+# Agents placed after attach are not followed.
+
+NEAR_EXIT = 3  # Chebyshev distance to the nearest exit of a clogging cell
+
+
+class Series:
+    # Sums over consecutive time windows of one width, `bins` windows at
+    # most: when a time falls after the last window, the windows are merged
+    # two by two and the width doubles.
+
+    def __init__(self, names, bins=256, width=1.0):
+        self.names = names
+        self.width = width
+        self.values = np.zeros((len(names), bins))
+
+    def window(self, t):
+        k = int(t//self.width)
+        while k >= self.values.shape[1]:
+            # with an odd number of windows the last one is merged alone
+            merged = self.values[:, 0::2].copy()
+            merged[:, :self.values.shape[1]//2] += self.values[:, 1::2]
+            self.values[:] = 0
+            self.values[:, :merged.shape[1]] = merged
+            self.width *= 2
+            k = int(t//self.width)
+        return k
+
+    def add(self, name, t, value):
+        k = int(t//self.width)
+        if k >= self.values.shape[1]:
+            k = self.window(t)
+        self.values[self.names.index(name), k] += value
+
+    def add_rate(self, name, t0, t1, rate):
+        # rate*(t1-t0), split between the windows crossed
+        row = self.names.index(name)
+        self.window(t1)
+        while t0 < t1:
+            k = int(t0//self.width)
+            end = min(t1, (k+1)*self.width)
+            self.values[row, k] += rate*(end-t0)
+            t0 = end
+
+    def used(self):
+        # number of windows up to the last non empty one
+        nonzero = np.flatnonzero(self.values.any(axis=0))
+        return int(nonzero[-1])+1 if len(nonzero) else 0
+
+    def as_dict(self):
+        n = self.used()
+        d = {"width": self.width, "start": self.width*np.arange(n)}
+        for name, row in zip(self.names, self.values[:, :n]):
+            d[name] = row
+        return d
+
+
+class FlowStats(RoomListener):
+
+    def __init__(self, window=1.0, bins=256, near_exit=NEAR_EXIT):
+        self.series = Series(("exits", "distance", "agent_time"), bins, window)
+        self.near_exit = near_exit
+        self.room = None
+
+    def attach(self, room):
+        shape = (room.dimX, room.dimY)
+        agents = room.get_types() == 1
+        self.room = room
+        self.start = room.time
+        self.last_time = room.time
+        self.agents = int(agents.sum())
+        self.present = self.agents  # agents in the room since last_time
+        # per cell, nested lists: cheaper than numpy for one cell at a time
+        self.occupied_time = np.zeros(shape).tolist()
+        self.occupied_since = np.where(agents, room.time, np.nan).tolist()  # time of arrival on the cell
+        self.entered = np.where(agents, room.time, np.nan).tolist()  # time the agent was first seen
+        self.conflicts = np.zeros(shape, dtype=np.int64)
+        self.refusals = np.zeros(shape, dtype=np.int64)
+        self.clogging = 0
+        self.distance = 0.0
+        self.evacuation_times = np.full(self.agents, np.nan)
+        self.exited = 0
+        room.listeners.append(self)
+        return self
+
+    def detach(self):
+        if self in self.room.listeners:
+            self.room.listeners.remove(self)
+
+    def on_move(self, i1, j1, i2, j2, exited):
+        now = self.room.time
+        step = math.hypot(i2-i1, j2-j1)
+        self.distance += step
+        self.series.add("distance", now, step)
+        self.occupied_time[i1][j1] += now-self.occupied_since[i1][j1]
+        self.occupied_since[i1][j1] = math.nan
+        if exited:
+            if self.exited < len(self.evacuation_times):
+                self.evacuation_times[self.exited] = now-self.entered[i1][j1]
+            self.exited += 1
+            self.series.add("exits", now, 1)
+        else:
+            self.occupied_since[i2][j2] = now
+            self.entered[i2][j2] = self.entered[i1][j1]
+        self.entered[i1][j1] = math.nan
+
+    def on_conflict(self, i, j, n, refused):
+        self.conflicts[i, j] += 1
+        if refused:
+            self.refusals[i, j] += 1
+            x, y = self.room.get_floor_field().closest_exit(i, j)
+            if max(abs(x-i), abs(y-j)) <= self.near_exit:
+                self.clogging += 1
+
+    def on_tick(self, room):
+        # the moves of a tick are made at room.time, the number of agents
+        # was `present` since the previous tick
+        if room.time > self.last_time:
+            self.series.add_rate("agent_time", self.last_time, room.time, self.present)
+            self.last_time = room.time
+        self.present = self.agents-self.exited
+
+    def occupancy(self):
+        # share of the time each cell was occupied since attach
+        elapsed = self.last_time-self.start
+        occupied = np.array(self.occupied_time)
+        if elapsed <= 0:
+            return np.zeros_like(occupied)
+        still = np.nan_to_num(self.last_time-np.array(self.occupied_since))
+        return (occupied+still)/elapsed
+
+    def summary(self):
+        series = self.series.as_dict()
+        width = series["width"]
+        agent_time = series["agent_time"]
+        evacuated = self.evacuation_times[:min(self.exited, len(self.evacuation_times))]
+        total_agent_time = float(agent_time.sum())
+        return {
+            "time": self.last_time-self.start,
+            "exited": self.exited,
+            "window": width,
+            "window_start": series["start"],
+            "flow": series["exits"]/width,
+            "density": agent_time/width,
+            "speed": np.divide(series["distance"], agent_time, out=np.zeros_like(agent_time),
+                               where=agent_time > 0),
+            "mean_speed": self.distance/total_agent_time if total_agent_time > 0 else math.nan,
+            "occupancy": self.occupancy(),
+            "conflicts": self.conflicts,
+            "refusals": self.refusals,
+            "clogging": self.clogging,
+            "evacuation_times": evacuated,
+            "mean_evacuation_time": float(evacuated.mean()) if len(evacuated) else math.nan,
+        }
@@ -0,0 +1,281 @@
+import numpy as np
+
+import kernel
+from evac import Room
+from floor_field import FloorField
+from rng import DECIDE
+
+# Room backend storing the grid as contiguous NumPy arrays (one array per
+# attribute) instead of dimX*dimY Cell objects. About 20 bytes per cell
+# against several hundred for a Cell with its lists and tuples.
+# room.cells[i][j] still works and returns a CellView on the arrays.
+
+
+class CellView:
+    __slots__ = ("room", "i", "j")
+
+    def __init__(self, room, i, j):
+        self.room = room
+        self.i = i
+        self.j = j
+
+    @property
+    def type(self):
+        return int(self.room.types[self.i, self.j])
+
+    @type.setter
+    def type(self, value):
+        self.room.types[self.i, self.j] = value
+
+    @property
+    def potential(self):
+        return float(self.room.potential[self.i, self.j])
+
+    @potential.setter
+    def potential(self, value):
+        # The potential array holds the static floor field, see get_potential.
+        pass
+
+    @property
+    def prediction(self):
+        return int(self.room.prediction[self.i, self.j])
+
+    @prediction.setter
+    def prediction(self, value):
+        self.room.prediction[self.i, self.j] = value
+
+    @property
+    def predicted_direction(self):
+        dX, dY = self.room.predicted_direction[self.i, self.j]
+        return (int(dX), int(dY))
+
+    @predicted_direction.setter
+    def predicted_direction(self, value):
+        self.room.predicted_direction[self.i, self.j] = value
+
+    @property
+    def next_update(self):
+        return float(self.room.next_update[self.i, self.j])
+
+    @next_update.setter
+    def next_update(self, value):
+        self.room.next_update[self.i, self.j] = value
+
+    # Waiting lists and bindings are sparse, they live in dictionaries and
+    # are only allocated for the cells that use them.
+    @property
+    def waiting_list(self):
+        return self.room.waiting_lists.setdefault((self.i, self.j), [])
+
+    @waiting_list.setter
+    def waiting_list(self, value):
+        if value:
+            self.room.waiting_lists[(self.i, self.j)] = value
+        else:
+            self.room.waiting_lists.pop((self.i, self.j), None)
+
+    @property
+    def bound_to(self):
+        return self.room.bindings.get((self.i, self.j), [])
+
+    @bound_to.setter
+    def bound_to(self, value):
+        if value:
+            self.room.bindings[(self.i, self.j)] = value
+        else:
+            self.room.bindings.pop((self.i, self.j), None)
+
+
+class CellColumn:
+    __slots__ = ("room", "i")
+
+    def __init__(self, room, i):
+        self.room = room
+        self.i = i
+
+    def __len__(self):
+        return self.room.dimY
+
+    def __getitem__(self, j):
+        if j < 0:
+            j += self.room.dimY
+        if not 0 <= j < self.room.dimY:
+            raise IndexError(j)
+        return CellView(self.room, self.i, j)
+
+    def __iter__(self):
+        return (CellView(self.room, self.i, j) for j in range(self.room.dimY))
+
+
+class CellGrid:
+    __slots__ = ("room",)
+
+    def __init__(self, room):
+        self.room = room
+
+    def __len__(self):
+        return self.room.dimX
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.room.dimX
+        if not 0 <= i < self.room.dimX:
+            raise IndexError(i)
+        return CellColumn(self.room, i)
+
+    def __iter__(self):
+        return (CellColumn(self.room, i) for i in range(self.room.dimX))
+
+
+class ArrayRoom(Room):
+
+    def __init__(self):
+        super().__init__()
+        self.types = None
+        self.potential = None
+        self.prediction = None
+        self.predicted_direction = None
+        self.next_update = None
+        self.waiting_lists = {}
+        self.bindings = {}
+        self.potential_source = None
+
+    def create_cells(self):
+        shape = (self.dimX, self.dimY)
+        self.types = np.zeros(shape, dtype=np.int8)
+        self.potential = np.zeros(shape, dtype=np.float64)
+        self.prediction = np.zeros(shape, dtype=np.int8)
+        self.predicted_direction = np.zeros(shape+(2,), dtype=np.int8)
+        self.predicted_direction[:, :, 0] = 1
+        self.next_update = np.zeros(shape, dtype=np.float64)
+        self.waiting_lists = {}
+        self.bindings = {}
+        self.cells = CellGrid(self)
+        self.scheduler = None
+        self.predictions_ready = False
+        self.blocked_by = {}
+        self.potential_source = None
+
+    def load_types(self, types):
+        self.types[:] = types
+
+    def get_types(self):
+        return self.types.copy()
+
+    def set_cell_type(self, i, j, t):
+        if 2 in (t, self.types[i, j]) or 3 in (t, self.types[i, j]):
+            self.floor_field = None
+        if self.scheduler is not None:
+            if self.types[i, j] == 1:
+                self.scheduler.remove((i, j))
+            if t == 1:
+                self.scheduler.add((i, j), float(self.next_update[i, j]))
+        if self.predictions_ready and self.types[i, j] == 1:
+            self.add_prediction(i, j, -1)
+        self.types[i, j] = t
+        if self.predictions_ready and t == 1:
+            self.add_prediction(i, j, 1)
+        if self.listeners:
+            self.notify("on_set", i, j, t)
+
+    def update_floor_field(self):
+        self.floor_field = FloorField(self.types, self.distance_mode)
+
+    def get_floor_field(self):
+        ff = Room.get_floor_field(self)
+        if self.potential_source != (ff, self.potential_strength):
+            self.potential[:] = ff.potential(self.potential_strength)
+            self.potential_source = (ff, self.potential_strength)
+        return ff
+
+    def get_potential(self, i, j):
+        self.get_floor_field()
+        return float(self.potential[i, j])
+
+    def add_prediction(self, i, j, sign):
+        dX, dY = self.predicted_direction[i, j].tolist()
+        if 0 <= i+dX < self.dimX and 0 <= j+dY < self.dimY:
+            self.prediction[i+dX, j+dY] += sign
+
+    def set_predicted_direction(self, i, j, direction):
+        if self.types[i, j] == 1:
+            self.add_prediction(i, j, -1)
+            self.predicted_direction[i, j] = direction
+            self.add_prediction(i, j, 1)
+        else:
+            self.predicted_direction[i, j] = direction
+
+    def rebuild_predictions(self):
+        agents = np.argwhere(self.types == 1)
+        tX = agents[:, 0]+self.predicted_direction[agents[:, 0], agents[:, 1], 0]
+        tY = agents[:, 1]+self.predicted_direction[agents[:, 0], agents[:, 1], 1]
+        inside = (tX >= 0) & (tX < self.dimX) & (tY >= 0) & (tY < self.dimY)
+        flat = tX[inside]*self.dimY+tY[inside]
+        counts = np.bincount(flat, minlength=self.dimX*self.dimY)
+        self.prediction[:] = counts.reshape(self.dimX, self.dimY)
+        self.predictions_ready = True
+
+    def get_indicator(self, i, j, dirX, dirY):
+        if self.is_in_bounds(i+dirX, j+dirY) and self.types[i, j] == 1:
+            own = self.predicted_direction[i, j]
+            return int(self.prediction[i+dirX, j+dirY])-int(own[0] == dirX and own[1] == dirY)
+        return 0
+
+    def get_agents(self):
+        agents = np.argwhere(self.types == 1)
+        times = self.next_update[agents[:, 0], agents[:, 1]]
+        return [((int(i), int(j)), float(t)) for (i, j), t in zip(agents, times)]
+
+    def choose_dirs(self, cells):
+        if not cells:
+            return []
+        ff = self.get_floor_field()
+        agents = np.array(cells, dtype=np.int64)
+        draws = self.rng.uniforms(DECIDE, self.tick, agents[:, 0]*self.dimY+agents[:, 1])
+        directions = kernel.choose_directions(
+            self.types, ff.walls, self.potential, self.prediction, self.predicted_direction,
+            ff.nearest_exit, ff.exit_shortcut(), agents, self.alpha, self.beta, self.gamma, draws)
+        return [(int(a), int(b)) for (a, b) in directions]
+
+    def release(self, i, j):
+        for blocker in self.bindings.pop((i, j), []):
+            bound = self.blocked_by.get(blocker)
+            if bound is not None and (i, j) in bound:
+                bound.remove((i, j))
+                if not bound:
+                    del self.blocked_by[blocker]
+
+    def get_cells_bound_to(self, i, j):
+        return [(x, y) for (x, y) in self.blocked_by.get((i, j), [])
+                if self.types[x, y] == 1]
+
+    def move_agent(self, i1, j1, i2, j2):
+        if self.types[i1, j1] == 1 and self.types[i2, j2] in (0, 3):
+            self.release(i1, j1)
+            if self.predictions_ready:
+                self.add_prediction(i1, j1, -1)
+            self.predicted_direction[i1, j1] = (1, 0)
+            self.types[i1, j1] = 0
+
+            self.predicted_direction[i2, j2] = (1, 0)
+            t = self.next_update[i1, j1]+1+0.5*int(abs(i1-i2)+abs(j1-j2) > 1)
+            self.next_update[i2, j2] = t
+            if self.types[i2, j2] != 3:
+                self.types[i2, j2] = 1
+                if self.predictions_ready:
+                    self.add_prediction(i2, j2, 1)
+            if self.types[i2, j2] == 3:
+                self.exited += 1
+            if self.listeners:
+                self.notify("on_move", i1, j1, i2, j2, bool(self.types[i2, j2] == 3))
+            if self.scheduler is not None:
+                if self.types[i2, j2] == 3:
+                    self.scheduler.remove((i1, j1))
+                else:
+                    self.scheduler.move((i1, j1), (i2, j2), float(t))
+            return True
+        return False
+
+    def resolve_conflicts(self, target_cells):
+        for (i, j) in dict.fromkeys(target_cells):
+            self.resolve_conflict(i, j, self.waiting_lists.pop((i, j), []))
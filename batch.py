@@ -0,0 +1,146 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import sys
+
+
+from array_room import ArrayRoom
+from ensemble import Ensemble
+from evac import Room, populate
+from rng import CounterRNG
+
+# Headless runs of the model over a grid of parameters, spread over a
+# process pool. One row of results per run.
+#   python batch.py --beta 0.5 0.8 --mu 0.2 0.33 --seed 0 1 2 -o results.csv
+
+PARAMETERS = ("alpha", "beta", "gamma", "mu", "potential_strength", "n_agents", "seed")
+BACKENDS = {"objects": Room, "arrays": ArrayRoom}
+
+
+def make_room(alpha, beta, gamma, mu, potential_strength, n_agents, seed,
+              backend="arrays"):
+    room = BACKENDS[backend]()
+    room.rng = CounterRNG(seed)
+    room.alpha = alpha
+    room.beta = beta
+    room.gamma = gamma
+    room.mu = mu
+    room.potential_strength = potential_strength
+    room.initialize_cells()
+    populate(room, n_agents)
+    return room
+
+
+def run_simulation(alpha, beta, gamma, mu, potential_strength, n_agents, seed,
+                   backend="arrays", max_ticks=10000, monitor=None):
+    # monitor: monitor.Monitor showing the run
+    room = make_room(alpha, beta, gamma, mu, potential_strength, n_agents, seed, backend)
+    if monitor is not None:
+        monitor.watch(room, " ".join("%s=%s" % (p, v) for p, v in zip(PARAMETERS, (
+            alpha, beta, gamma, mu, potential_strength, n_agents, seed))))
+    outflow = []
+    while room.scheduler and len(outflow) < max_ticks:
+        exited = room.exited
+        room.update_cells()
+        outflow.append(room.exited-exited)
+    return {
+        "alpha": alpha, "beta": beta, "gamma": gamma, "mu": mu,
+        "potential_strength": potential_strength, "n_agents": n_agents, "seed": seed,
+        "evacuated": not room.scheduler,
+        "evacuation_time": room.time,
+        "ticks": len(outflow),
+        "remaining": len(room.scheduler),
+        "conflicts": room.conflicts,
+        "refused": room.refused,
+        "outflow": " ".join(str(n) for n in outflow),
+    }
+
+
+def run_ensemble(alpha, beta, gamma, mu, potential_strength, n_agents, seed,
+                 replicas, max_ticks=10000):
+    # One row for `replicas` runs from the same starting room.
+    room = make_room(alpha, beta, gamma, mu, potential_strength, n_agents, seed)
+    summary = Ensemble(room, replicas).run(max_ticks)
+    row = {
+        "alpha": alpha, "beta": beta, "gamma": gamma, "mu": mu,
+        "potential_strength": potential_strength, "n_agents": n_agents, "seed": seed,
+        "replicas": replicas, "evacuated": summary["evacuated"], "ticks": summary["ticks"],
+    }
+    for key in ("evacuation_time", "flow", "conflicts", "refused"):
+        d = summary[key]
+        row[key+"_mean"] = d["mean"]
+        row[key+"_var"] = d["var"]
+        row[key+"_ci_low"], row[key+"_ci_high"] = d["ci"]
+    return row
+
+
+def run_one(job, monitor=None):
+    params, backend, max_ticks, replicas = job
+    if replicas:
+        return run_ensemble(*params, replicas=replicas, max_ticks=max_ticks)
+    return run_simulation(*params, backend=backend, max_ticks=max_ticks, monitor=monitor)
+
+
+def parameter_grid(values):
+    # values: parameter name -> list of values, every combination is run
+    return list(itertools.product(*(values[p] for p in PARAMETERS)))
+
+
+def sweep(values, processes=None, backend="arrays", max_ticks=10000, replicas=0,
+          monitor=None):
+    # replicas > 0: one ensemble.Ensemble per combination instead of one run
+    # monitor: the runs are made one after the other in this process and
+    # shown by this monitor.Monitor
+    jobs = [(params, backend, max_ticks, replicas) for params in parameter_grid(values)]
+    if processes == 1 or monitor is not None:
+        return [run_one(job, monitor) for job in jobs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(run_one, jobs, chunksize=max(1, len(jobs)//(4*(processes or multiprocessing.cpu_count()))))
+
+
+def write_results(results, f):
+    writer = csv.DictWriter(f, fieldnames=list(results[0]) if results else list(PARAMETERS))
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main(argv=None):
+    default = Room()
+    parser = argparse.ArgumentParser(description="Parameter sweep of the evacuation model.")
+    parser.add_argument("--alpha", type=float, nargs="+", default=[default.alpha])
+    parser.add_argument("--beta", type=float, nargs="+", default=[default.beta])
+    parser.add_argument("--gamma", type=float, nargs="+", default=[default.gamma])
+    parser.add_argument("--mu", type=float, nargs="+", default=[default.mu])
+    parser.add_argument("--potential-strength", type=float, nargs="+",
+                        default=[default.potential_strength])
+    parser.add_argument("--n-agents", type=int, nargs="+", default=[100])
+    parser.add_argument("--seed", type=int, nargs="+", default=[0])
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="arrays")
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    parser.add_argument("--replicas", type=int, default=0,
+                        help="statistics over this many runs per combination")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="size of the pool, every core by default")
+    parser.add_argument("--monitor", type=int, metavar="PORT",
+                        help="watch the runs at http://127.0.0.1:PORT/, runs them in this process")
+    parser.add_argument("-o", "--output", help="CSV file, standard output by default")
+    args = parser.parse_args(argv)
+    values = {p: getattr(args, p) for p in PARAMETERS}
+    if args.monitor is not None:
+        from monitor import Monitor
+        with Monitor(port=args.monitor) as monitor:
+            print("watching on", monitor.url(), file=sys.stderr)
+            results = sweep(values, args.processes, args.backend, args.max_ticks,
+                            args.replicas, monitor)
+    else:
+        results = sweep(values, args.processes, args.backend, args.max_ticks, args.replicas)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            write_results(results, f)
+    else:
+        write_results(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import main
+from array_room import ArrayRoom
+from evac import Room, populate
+from profiling import RoomStats
+from rng import CounterRNG
+
+# Timing of the update_cells hot path of both models, over grid sizes and
+# agent densities, with a breakdown per phase. Results go to a JSON file
+# that can be compared with a previous one:
+#   python benchmark.py -o bench.json
+#   python benchmark.py --compare bench.json
+
+SIZES = [(26, 14), (100, 100), (300, 300)]
+QUICK_SIZES = [(26, 14), (50, 50)]
+DENSITIES = [0.05, 0.25, 0.5, 0.9]
+# phase -> method timed by RoomStats
+PHASES = {"prediction": "update_prediction", "decision": "choose_dirs",
+          "conflict": "resolve_conflict", "motion": "move_agent"}
+MAIN_PHASES = {"decision": "choose_dir", "conflict": "resolve_conflict"}
+
+
+def make_evac(cls, dimX, dimY, n_agents, seed):
+    room = cls()
+    room.rng = CounterRNG(seed)
+    room.dimX, room.dimY = dimX, dimY
+    room.initialize_cells()
+    populate(room, n_agents)
+    stats = room.enable_profiling()
+    return room, stats, PHASES, lambda: len(room.scheduler) if room.scheduler is not None else n_agents
+
+
+def make_main(dimX, dimY, n_agents, seed):
+    room = main.room((dimX, dimY))
+    room.rng = CounterRNG(seed)
+    main.populate(room, n_agents)
+    room.cells[room.sortie].n = 3
+    # main.py has no separate prediction step, motion happens inside
+    # resolve_conflict
+    stats = RoomStats()
+    for method in MAIN_PHASES.values():
+        stats.wrap(room, method)
+
+    def remaining():
+        if room.scheduler is None:
+            return sum(c.n == 1 for c in room.cells.values())
+        return len(room.scheduler)
+    return room, stats, MAIN_PHASES, remaining
+
+
+MODELS = {
+    "evac": lambda *args: make_evac(Room, *args),
+    "evac-arrays": lambda *args: make_evac(ArrayRoom, *args),
+    "main": make_main,
+}
+
+
+def run_benchmark(model, dimX, dimY, density, seed, max_ticks, time_limit):
+    # agents are placed in the left half of the room by both populate
+    n_agents = max(1, int(density*(dimX//2)*dimY))
+    start = time.perf_counter()
+    room, stats, methods, remaining = MODELS[model](dimX, dimY, n_agents, seed)
+    setup = time.perf_counter()-start
+    ticks = 0
+    start = time.perf_counter()
+    while ticks < max_ticks and remaining() > 0 and time.perf_counter()-start < time_limit:
+        room.update_cells()
+        ticks += 1
+    wall = time.perf_counter()-start
+    phases = {phase: stats.time.get(methods.get(phase), 0.0) for phase in PHASES}
+    # moves are timed inside the conflict phase
+    phases["conflict"] -= phases["motion"]
+    phases["other"] = wall-sum(phases.values())
+    evacuated = remaining() == 0
+    return {
+        "model": model, "dimX": dimX, "dimY": dimY, "density": density,
+        "n_agents": n_agents, "seed": seed,
+        "setup_time": setup,
+        "ticks": ticks,
+        "wall_time": wall,
+        "ticks_per_second": ticks/wall if wall > 0 else None,
+        "evacuated": evacuated,
+        "evacuation_wall_time": wall if evacuated else None,
+        "phases": phases,
+    }
+
+
+def key(result):
+    return (result["model"], result["dimX"], result["dimY"], result["density"], result["seed"])
+
+
+def compare(results, previous):
+    old = {key(r): r for r in previous}
+    for r in results:
+        o = old.get(key(r))
+        if o and o["ticks_per_second"] and r["ticks_per_second"]:
+            ratio = r["ticks_per_second"]/o["ticks_per_second"]
+            print("%-12s %4dx%-4d %4.0f%%  %10.1f -> %10.1f ticks/s  (x%.2f)" % (
+                r["model"], r["dimX"], r["dimY"], 100*r["density"],
+                o["ticks_per_second"], r["ticks_per_second"], ratio))
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of update_cells.")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=sorted(MODELS))
+    parser.add_argument("--sizes", nargs="+", default=None,
+                        help="grid sizes as XxY, e.g. 26x14 300x300")
+    parser.add_argument("--densities", type=float, nargs="+", default=DENSITIES)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--max-ticks", type=int, default=200)
+    parser.add_argument("--time-limit", type=float, default=20,
+                        help="seconds per run, the run stops after the current tick")
+    parser.add_argument("--quick", action="store_true", help="small grids only")
+    parser.add_argument("-o", "--output", default="bench_output.json")
+    parser.add_argument("--compare", help="previous JSON output to compare with")
+    args = parser.parse_args(argv)
+    if args.sizes:
+        sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes]
+    else:
+        sizes = QUICK_SIZES if args.quick else SIZES
+    results = []
+    for model in args.models:
+        for (dimX, dimY) in sizes:
+            for density in args.densities:
+                for seed in args.seeds:
+                    r = run_benchmark(model, dimX, dimY, density, seed,
+                                      args.max_ticks, args.time_limit)
+                    results.append(r)
+                    print("%-12s %4dx%-4d %4.0f%%  %5d ticks  %10.1f ticks/s" % (
+                        model, dimX, dimY, 100*density, r["ticks"], r["ticks_per_second"] or 0),
+                        file=sys.stderr)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "max_ticks": args.max_ticks,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,130 @@
+import json
+
+import numpy as np
+
+from array_room import ArrayRoom
+from evac import Room
+from floor_field import FloorField
+from rng import CounterRNG
+
+# Snapshot of a Room or ArrayRoom between two ticks, in one binary file:
+#   8 bytes   MAGIC
+#   8 bytes   length of the JSON header (little endian)
+#   header    parameters, counters, RNG seed and the table of the arrays
+#   arrays    raw arrays, each aligned on ALIGN bytes
+# restore() memory-maps the file copy-on-write: an ArrayRoom works directly
+# on the mapped pages and only the pages it modifies are copied, so many
+# what-if runs can start from one warm-up state:
+#   checkpoint.save(room, "warm.ckpt")
+#   what_if = checkpoint.restore("warm.ckpt")
+#   what_if.set_cell_type(25, 7, 2)  # close an exit
+# The waiting lists are empty between two ticks and are not saved. The
+# scheduler is rebuilt from the clocks of the agents.
+
+MAGIC = b"EVACKPT1"
+ALIGN = 64
+PARAMETERS = ("dimX", "dimY", "alpha", "beta", "gamma", "mu", "potential_strength",
+              "max_depth", "synchronous", "distance_mode", "time", "tick", "exited", "conflicts",
+              "refused")
+BACKENDS = {"Room": Room, "ArrayRoom": ArrayRoom}
+
+
+def snapshot(room):
+    # (parameters, arrays) describing the state of the room
+    params = {name: getattr(room, name) for name in PARAMETERS}
+    params["backend"] = "ArrayRoom" if isinstance(room, ArrayRoom) else "Room"
+    params["seed"] = room.rng.seed
+    ff = room.get_floor_field()
+    params["diagonal_cost"] = ff.diagonal_cost
+    room.update_prediction()
+    if isinstance(room, ArrayRoom):
+        arrays = {"types": room.types, "next_update": room.next_update,
+                  "predicted_direction": room.predicted_direction,
+                  "prediction": room.prediction}
+    else:
+        cells = [c for col in room.cells for c in col]
+        shape = (room.dimX, room.dimY)
+        arrays = {
+            "types": np.array([c.type for c in cells], dtype=np.int8).reshape(shape),
+            "next_update": np.array([c.next_update for c in cells]).reshape(shape),
+            "predicted_direction": np.array([c.predicted_direction for c in cells],
+                                            dtype=np.int8).reshape(shape+(2,)),
+            "prediction": np.array([c.prediction for c in cells], dtype=np.int8).reshape(shape),
+        }
+    # one (agent, blocker) row per binding
+    bindings = [(i, j, a, b) for (a, b), bound in room.blocked_by.items() for (i, j) in bound]
+    arrays["bindings"] = np.array(bindings, dtype=np.int32).reshape(-1, 4)
+    arrays["distance"] = ff.distance
+    arrays["nearest_exit"] = ff.nearest_exit
+    return params, arrays
+
+
+def save(room, path):
+    params, arrays = snapshot(room)
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        table[name] = (array.dtype.str, array.shape, offset)
+        offset += -(-array.nbytes//ALIGN)*ALIGN
+    header = json.dumps({"params": params, "arrays": table}).encode()
+    start = -(-(len(MAGIC)+8+len(header))//ALIGN)*ALIGN
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start+table[name][2])
+            f.write(array.tobytes())
+        f.truncate(start+offset)
+
+
+def open_snapshot(path, mode="c"):
+    # (parameters, arrays), the arrays are views on a memory map of the file
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a room checkpoint" % path)
+        length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(length))
+    start = -(-(len(MAGIC)+8+length)//ALIGN)*ALIGN
+    data = np.memmap(path, dtype=np.uint8, mode=mode)
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))*dtype.itemsize
+        arrays[name] = data[start+offset:start+offset+size].view(dtype).reshape(shape)
+    return header["params"], arrays
+
+
+def restore(path, cls=None):
+    # New room in the saved state, of the saved backend unless cls is given.
+    params, arrays = open_snapshot(path)
+    room = (cls or BACKENDS[params["backend"]])()
+    for name in PARAMETERS:
+        setattr(room, name, params[name])
+    room.rng = CounterRNG(params["seed"])
+    room.create_cells()
+    types = arrays["types"]
+    if isinstance(room, ArrayRoom):
+        room.types = arrays["types"]
+        room.next_update = arrays["next_update"]
+        room.predicted_direction = arrays["predicted_direction"]
+        room.prediction = arrays["prediction"]
+    else:
+        for (i, j) in np.argwhere(types != 0):
+            c = room.cells[i][j]
+            c.type = int(types[i, j])
+            c.next_update = float(arrays["next_update"][i, j])
+        for (i, j) in np.argwhere(np.any(arrays["predicted_direction"] != (1, 0), axis=2)):
+            room.cells[i][j].predicted_direction = tuple(int(v) for v in arrays["predicted_direction"][i, j])
+        for (i, j) in np.argwhere(arrays["prediction"] != 0):
+            room.cells[i][j].prediction = int(arrays["prediction"][i, j])
+    room.predictions_ready = True
+    static = np.where(types == 1, 0, types)
+    room.floor_field = FloorField.from_arrays(static, params["distance_mode"], arrays["distance"],
+                                              arrays["nearest_exit"], params["diagonal_cost"])
+    for (i, j, a, b) in arrays["bindings"].tolist():
+        room.bind(i, j, a, b)
+    room.rebuild_scheduler()
+    return room
@@ -0,0 +1,3 @@
+# pytest: the modules are imported from the repository root, gui_test.py is
+# an interactive script, not a test
+collect_ignore = ["gui_test.py"]
@@ -0,0 +1,269 @@
+import argparse
+import math
+
+import numpy as np
+
+import kernel
+from checkpoint import snapshot
+from evac import Room, populate
+from rng import DECIDE, PICK, REFUSE, CounterRNG
+
+# R independent replicas of one room advanced in lockstep, for Monte Carlo
+# statistics of the evacuation time. The state of every replica is held in
+# (R, dimX, dimY) arrays and one call to step() plays one update_cells of
+# each replica at once:
+#   - each replica has its own clock, its cohort is made of its agents with
+#     the smallest next_update, as with the AgentScheduler of a Room;
+#   - the blocked chains are solved one level at a time for every replica
+#     together. The chains of a tick never share a cell, so this gives the
+#     same moves as the sequential Room.resolve_conflict;
+#   - only the occupied cells (self.agents) are visited, the cost of a tick
+#     follows the number of agents left, not the size of the grid;
+#   - with room.synchronous, every agent of every replica is in the cohort
+#     and a tick lasts one time unit (parallel update, Room.synchronous).
+# Draws are keyed like in a Room (rng.py), the cells of replica k being
+# numbered from k*dimX*dimY: a replica does not depend on the number of
+# replicas, and replica 0 plays the same run as the room it started from.
+#   python ensemble.py --replicas 200 --n-agents 100 --seed 0
+
+Z_95 = 1.96  # normal approximation of the 95% confidence interval
+NO_BINDING = -1
+
+
+class Ensemble:
+
+    def __init__(self, room, replicas, seed=None):
+        # Every replica starts from the current state of `room`, and uses its
+        # random numbers unless a seed is given.
+        self.replicas = replicas
+        self.alpha = room.alpha
+        self.beta = room.beta
+        self.gamma = room.gamma
+        self.mu = room.mu
+        self.max_depth = room.max_depth
+        self.synchronous = room.synchronous
+        self.dimX, self.dimY = room.dimX, room.dimY
+        ff = room.get_floor_field()
+        self.walls = ff.walls
+        self.potential = ff.potential(room.potential_strength)
+        self.nearest_exit = ff.nearest_exit
+        self.shortcut = ff.exit_shortcut()
+        shape = (replicas, self.dimX, self.dimY)
+        _, state = snapshot(room)
+        self.types = np.empty(shape, dtype=np.int8)
+        self.types[:] = state["types"]
+        self.next_update = np.empty(shape)
+        self.next_update[:] = state["next_update"]
+        self.predicted_direction = np.empty(shape+(2,), dtype=np.int8)
+        self.predicted_direction[:] = state["predicted_direction"]
+        self.prediction = np.zeros(shape, dtype=np.int16)
+        self.predicted_cells = np.zeros(0, dtype=np.int64)  # cells counted in prediction
+        # flat index in the replica of the cell each agent is bound to
+        self.bound_to = np.full(replicas*self.dimX*self.dimY, NO_BINDING, dtype=np.int64)
+        i, j, a, b = state["bindings"].T.astype(np.int64)
+        self.bound_to.reshape(replicas, -1)[:, i*self.dimY+j] = a*self.dimY+b
+        self.rng = room.rng if seed is None else CounterRNG(seed)
+        self.n_agents = int((self.types[0] == 1).sum())
+        # flat indices of the occupied cells of every replica
+        self.agents = np.flatnonzero(self.types == 1)
+        self.time = np.zeros(replicas)  # time of the last cohort of each replica
+        self.ticks = np.full(replicas, room.tick, dtype=np.int64)
+        self.exited = np.zeros(replicas, dtype=np.int64)
+        self.conflicts = np.zeros(replicas, dtype=np.int64)
+        self.refused = np.zeros(replicas, dtype=np.int64)
+        self.tick = 0
+
+    def remaining(self):
+        return np.bincount(self.agents//(self.dimX*self.dimY), minlength=self.replicas)
+
+    def unravel(self, cells):
+        r, cell = np.divmod(cells, self.dimX*self.dimY)
+        x, y = np.divmod(cell, self.dimY)
+        return r, x, y
+
+    def draw(self, purpose, cells):
+        # cells: flat indices in the (R, dimX, dimY) grid
+        replica = cells//(self.dimX*self.dimY)
+        return self.rng.uniforms(purpose, self.ticks[replica], cells)
+
+    def rebuild_predictions(self):
+        # Only the cells counted at the previous tick are cleared.
+        prediction = self.prediction.reshape(-1)
+        prediction[self.predicted_cells] = 0
+        r, x, y = self.unravel(self.agents)
+        tX = x+self.predicted_direction[r, x, y, 0]
+        tY = y+self.predicted_direction[r, x, y, 1]
+        inside = (tX >= 0) & (tX < self.dimX) & (tY >= 0) & (tY < self.dimY)
+        cells = (r[inside]*self.dimX+tX[inside])*self.dimY+tY[inside]
+        np.add.at(prediction, cells, 1)
+        self.predicted_cells = cells
+
+    def get_cohort(self):
+        if self.synchronous:
+            active = self.remaining() > 0
+            self.time[active] = self.ticks[active]
+            return self.unravel(self.agents)
+        replica = self.agents//(self.dimX*self.dimY)
+        clocks = self.next_update.reshape(-1)[self.agents]
+        now = np.full(self.replicas, np.inf)
+        np.minimum.at(now, replica, clocks)
+        active = np.isfinite(now)
+        self.time[active] = now[active]
+        return self.unravel(self.agents[clocks == now[replica]])
+
+    def choose_dirs(self, cohort):
+        r, x, y = cohort
+        agents = np.stack([x, y], axis=1)
+        draws = self.draw(DECIDE, (r*self.dimX+x)*self.dimY+y)
+        probs = kernel.transition_probabilities(
+            self.types, self.walls, self.potential, self.prediction, self.predicted_direction,
+            agents, self.alpha, self.beta, self.gamma, r)
+        directions = kernel.DIRECTIONS[kernel.inverse_cdf(probs, draws)]
+        return kernel.exit_override(directions, agents, self.nearest_exit, self.shortcut)
+
+    def step(self):
+        types = self.types.reshape(-1)
+        size = self.dimX*self.dimY
+        if not len(self.agents):
+            return False
+        self.rebuild_predictions()
+        cohort = self.get_cohort()
+        r, x, y = cohort
+        directions = self.choose_dirs(cohort)
+        self.predicted_direction[r, x, y] = directions
+        source = (r*self.dimX+x)*self.dimY+y
+        self.bound_to[source] = NO_BINDING
+        a, b = x+directions[:, 0], y+directions[:, 1]
+        moving = (a != x) | (b != y)
+        target = (r*self.dimX+a)*self.dimY+b
+        free = moving & ((types[target] == 0) | (types[target] == 3))
+        blocked = moving & (types[target] == 1)
+        self.bound_to[source[blocked]] = target[blocked]-r[blocked]*size
+        clock = self.next_update.reshape(-1)
+        old_clock = clock[source].copy()
+        candidates, goals = source[free], target[free]
+        left, arrived = [], []
+        depth = 0
+        while len(candidates) and (self.max_depth is None or depth < self.max_depth):
+            movers, goals = self.resolve_conflicts(candidates, goals)
+            left.append(movers)
+            arrived.append(goals[types[goals] != 3])
+            self.move_agents(movers, goals)
+            candidates, goals = self.pop_bound(movers)
+            depth += 1
+        if left:
+            left = np.concatenate(left)
+            self.agents = np.concatenate([self.agents[~np.isin(self.agents, left)]]+arrived)
+        # Agents who could not move try again one time unit later.
+        stuck = clock[source] == old_clock
+        clock[source[stuck & (types[source] == 1)]] += 1
+        self.ticks[np.unique(r)] += 1
+        self.tick += 1
+        return True
+
+    def resolve_conflicts(self, candidates, goals):
+        # One winner per requested cell. With several candidates nobody
+        # moves with probability mu, else the candidate with the smallest
+        # draw wins (Room.resolve_conflict).
+        order = np.lexsort((self.draw(PICK, candidates), goals))
+        candidates, goals = candidates[order], goals[order]
+        cells, start, n = np.unique(goals, return_index=True, return_counts=True)
+        replica = cells//(self.dimX*self.dimY)
+        contested = n > 1
+        refused = contested & (self.draw(REFUSE, cells) <= self.mu)
+        np.add.at(self.conflicts, replica[contested], 1)
+        np.add.at(self.refused, replica[refused], 1)
+        keep = ~refused
+        return candidates[start[keep]], cells[keep]
+
+    def move_agents(self, sources, targets):
+        types = self.types.reshape(-1)
+        clock = self.next_update.reshape(-1)
+        direction = self.predicted_direction.reshape(-1, 2)
+        size = self.dimX*self.dimY
+        dX = (targets % size)//self.dimY-(sources % size)//self.dimY
+        dY = targets % self.dimY-sources % self.dimY
+        # the agent keeps its own clock, plus the 3/2 diagonal penalty
+        clock[targets] = clock[sources]+1+0.5*(np.abs(dX)+np.abs(dY) > 1)
+        types[sources] = 0
+        exits = types[targets] == 3
+        types[targets[~exits]] = 1
+        np.add.at(self.exited, targets[exits]//size, 1)
+        direction[sources] = (1, 0)
+        direction[targets] = (1, 0)
+        self.bound_to[sources] = NO_BINDING
+        self.bound_to[targets] = NO_BINDING
+
+    def pop_bound(self, freed):
+        # Agents bound to the freed cells: they compete for them next, and
+        # lose their binding whatever happens.
+        size = self.dimX*self.dimY
+        bound = self.agents[self.bound_to[self.agents] != NO_BINDING]
+        blocker = bound//size*size+self.bound_to[bound]
+        hit = np.isin(blocker, freed)
+        bound, blocker = bound[hit], blocker[hit]
+        self.bound_to[bound] = NO_BINDING
+        alive = self.types.reshape(-1)[bound] == 1
+        return bound[alive], blocker[alive]
+
+    def run(self, max_ticks=10000):
+        while self.tick < max_ticks and self.step():
+            pass
+        return self.summary()
+
+    def summary(self):
+        evacuated = self.remaining() == 0
+        time = self.time[evacuated]
+        flow = self.n_agents/time[time > 0]
+        return {
+            "replicas": self.replicas, "n_agents": self.n_agents,
+            "evacuated": int(evacuated.sum()), "ticks": self.tick,
+            "evacuation_time": describe(time),
+            "flow": describe(flow),
+            "conflicts": describe(self.conflicts),
+            "refused": describe(self.refused),
+        }
+
+
+def describe(values):
+    n = len(values)
+    if n == 0:
+        return {"n": 0, "mean": math.nan, "var": math.nan, "ci": (math.nan, math.nan)}
+    mean = float(np.mean(values))
+    var = float(np.var(values, ddof=1)) if n > 1 else 0.0
+    half = Z_95*math.sqrt(var/n)
+    return {"n": n, "mean": mean, "var": var, "ci": (mean-half, mean+half)}
+
+
+def make_ensemble(replicas, n_agents, seed=0, room=None, synchronous=False):
+    # Same starting room as batch.run_simulation for this seed.
+    if room is None:
+        room = Room()
+        room.rng = CounterRNG(seed)
+        room.synchronous = synchronous
+        room.initialize_cells()
+        populate(room, n_agents)
+    return Ensemble(room, replicas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo statistics of the evacuation time.")
+    parser.add_argument("--replicas", type=int, default=100)
+    parser.add_argument("--n-agents", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    parser.add_argument("--synchronous", action="store_true",
+                        help="every agent moves at every tick (parallel update)")
+    args = parser.parse_args(argv)
+    summary = make_ensemble(args.replicas, args.n_agents, args.seed,
+                            synchronous=args.synchronous).run(args.max_ticks)
+    print("%d/%d replicas evacuated in %d ticks" % (
+        summary["evacuated"], summary["replicas"], summary["ticks"]))
+    for key in ("evacuation_time", "flow", "conflicts", "refused"):
+        d = summary[key]
+        print("%-16s mean %9.3f  var %9.3f  95%% CI [%.3f, %.3f]" % (
+            key, d["mean"], d["var"], d["ci"][0], d["ci"][1]))
+
+
+if __name__ == "__main__":
+    main()
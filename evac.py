@@ -1,19 +1,45 @@
 import math
-import random
 #from nltk.probability import FreqDist, MLEProbDist
-import matplotlib.pyplot as plt
+import numpy as np
+
+import kernel
+from floor_field import ANISOTROPIC, FloorField
+from rng import DECIDE, PICK, PLACE, REFUSE, CounterRNG, inverse_cdf
+from scheduler import AgentScheduler
+
+NO_CELLS = ()  # shared empty waiting list / binding, a list is made on first use
+DEFAULT_DIRECTION = (1, 0)
+
 
 class Cell:
+    __slots__ = ("type", "waiting_list", "bound_to", "predicted_direction",
+                 "prediction", "potential", "next_update")
 
     def __init__(self):
         self.type = 0  # 0 -> floor | 1 -> occupied | 2 -> wall | 3 -> exit
-        self.waiting_list = []
-        self.bound_to = []
-        self.predicted_direction = (int(1), int(0))
+        self.waiting_list = NO_CELLS
+        self.bound_to = NO_CELLS
+        self.predicted_direction = DEFAULT_DIRECTION
         self.prediction = 0
         self.potential = 0
         self.next_update = 0.0
 
+class RoomListener:
+    # Observers of a Room (recorders, statistics...), see Room.listeners.
+
+    def on_move(self, i1, j1, i2, j2, exited):
+        pass
+
+    def on_conflict(self, i, j, n, refused):
+        pass
+
+    def on_tick(self, room):
+        pass
+
+    def on_set(self, i, j, t):
+        # type of a cell changed from outside the dynamics (set_cell_type)
+        pass
+
 class Room:
 
     def __init__(self):
@@ -25,51 +51,151 @@ class Room:
         self.beta = 0.8
         self.gamma = 0.2
         self.mu = 0.33
+        self.distance_mode = ANISOTROPIC  # or floor_field.OBSTACLE
+        self.floor_field = None
+        self.attraction = None  # u and best neighbour u of every cell, see get_attraction
+        self.attraction_source = None
+        self.scheduler = None
+        self.predictions_ready = False
+        self.blocked_by = {}  # blocker cell -> agents bound behind it
+        self.max_depth = 4  # length of the blocked chains moved, None for all
+        self.synchronous = False  # every agent updated at every tick, see get_agent_to_update
+        self.time = 0.0
+        self.tick = 0
+        self.listeners = []  # RoomListener objects notified of every event
+        self.stats = None  # profiling.RoomStats when profiling is enabled
+        self.rng = CounterRNG()  # draws keyed by (tick, cell), see rng.py
+        # counters since the beginning of the run
+        self.exited = 0
+        self.conflicts = 0  # cells requested by more than one agent
+        self.refused = 0  # conflicts where nobody moved (probability mu)
 
     def initialize_cells(self):
-        self.cells = [[Cell() for j in range(self.dimY)]
-                      for i in range(self.dimX)]
+        self.create_cells()
         self.cells[-1][int(self.dimY/2)].type = 3
         self.cells[-1][int(self.dimY/2+1)].type = 3
+        self.update_floor_field()
 
+    def create_cells(self):
+        self.cells = [[Cell() for j in range(self.dimY)]
+                      for i in range(self.dimX)]
+        self.scheduler = None
+        self.predictions_ready = False
+        self.blocked_by = {}
+
+    def load_types(self, types):
+        for (i, j) in np.argwhere(types != 0):
+            self.cells[i][j].type = int(types[i, j])
+
+    def apply_layout(self, layout):
+        # Room built from a compiled layout.Layout, its floor field is reused
+        # as is.
+        self.dimX, self.dimY = layout.dimX, layout.dimY
+        self.create_cells()
+        self.load_types(layout.initial_types())
+        self.distance_mode = layout.floor_field.mode
+        self.floor_field = layout.floor_field
+        self.sync_agents()
+
+    def set_cell_type(self, i, j, t):
+        # Walls and exits are the only types the floor field depends on.
+        if 2 in (t, self.cells[i][j].type) or 3 in (t, self.cells[i][j].type):
+            self.floor_field = None
+        if self.scheduler is not None:
+            if self.cells[i][j].type == 1:
+                self.scheduler.remove((i, j))
+            if t == 1:
+                self.scheduler.add((i, j), self.cells[i][j].next_update)
+        if self.predictions_ready and self.cells[i][j].type == 1:
+            self.add_prediction(i, j, -1)
+        self.cells[i][j].type = t
+        if self.predictions_ready and t == 1:
+            self.add_prediction(i, j, 1)
+        if self.listeners:
+            self.notify("on_set", i, j, t)
+
+    def update_floor_field(self):
+        types = [[c.type for c in col] for col in self.cells]
+        self.floor_field = FloorField(types, self.distance_mode)
+
+    def get_floor_field(self):
+        if self.floor_field is None or self.floor_field.mode != self.distance_mode:
+            self.update_floor_field()
+        return self.floor_field
+
+    def get_types(self):
+        return np.array([[c.type for c in col] for col in self.cells], dtype=np.int8)
+
+    def notify(self, event, *args):
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    def enable_profiling(self, callback=None):
+        # Times and counts the phases of update_cells, see profiling.py.
+        from profiling import RoomStats
+        self.disable_profiling()
+        self.stats = RoomStats(callback)
+        self.stats.attach(self)
+        return self.stats
+
+    def disable_profiling(self):
+        if self.stats is not None:
+            self.stats.detach(self)
+            self.stats = None
 
     def closest_exit(self, i, j):
-        min_d = float('inf')
-        res = (0, 0)
-        for x in range(self.dimX):
-            for y in range(self.dimY):
-                if self.cells[x][y].type == 3:
-                    d = math.sqrt((x-i)**2+(y-j)**2)
-                    if d < min_d:
-                        min_d = d
-                        res = (x, y)
-        return res
+        return self.get_floor_field().closest_exit(i, j)
 
     def get_distance(self, i, j):
-        sortieX, sortieY = self.closest_exit(i, j)
-        if i != sortieX:
-            return math.sqrt((10*(sortieY-j)**2)/abs(sortieX-i)+(sortieX-i)**2)
-        return 0
-        # return math.sqrt((sortieX-i)**2+(sortieY-j)**2)
+        return self.get_floor_field().get_distance(i, j)
 
     def get_potential(self, i, j):
         return -self.potential_strength*self.get_distance(i, j)
 
-    def update_prediction(self):
-        d = {}
+    def get_attraction(self):
+        # The attraction of a move from (i, j) to (x, y) is
+        # exp(alpha*(u[x][y]-best[i][j])), relative to the best move allowed
+        # from (i, j) (kernel.best_neighbour): the absolute exp(alpha*u)
+        # underflows to 0 far from the exits. u and best only depend on the
+        # floor field and potential_strength, they are computed once for the
+        # whole grid and again only when one of them changes.
+        ff = self.get_floor_field()
+        source = (ff, self.potential_strength)
+        if self.attraction_source != source:
+            u = ff.potential(self.potential_strength)
+            self.attraction = (u.tolist(), kernel.best_neighbour(ff.walls, u).tolist())
+            self.attraction_source = source
+        return self.attraction
+
+    # cell.prediction counts the agents whose predicted direction points to
+    # the cell. It is kept up to date by set_predicted_direction and
+    # move_agent, only the agents (type 1) are counted.
+    def add_prediction(self, i, j, sign):
+        dX, dY = self.cells[i][j].predicted_direction
+        if 0 <= i+dX < self.dimX and 0 <= j+dY < self.dimY:
+            self.cells[i+dX][j+dY].prediction += sign
+
+    def set_predicted_direction(self, i, j, direction):
+        if self.cells[i][j].type == 1:
+            self.add_prediction(i, j, -1)
+            self.cells[i][j].predicted_direction = direction
+            self.add_prediction(i, j, 1)
+        else:
+            self.cells[i][j].predicted_direction = direction
+
+    def rebuild_predictions(self):
+        for col in self.cells:
+            for c in col:
+                c.prediction = 0
         for i in range(self.dimX):
             for j in range(self.dimY):
-                dX, dY = self.cells[i][j].predicted_direction
-                if (i+dX, j+dY) in d:
-                    d[(i+dX, j+dY)] += 1
-                else:
-                    d[(i+dX, j+dY)] = 1
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                if (i, j) in d:
-                    self.cells[i][j].prediction = d[(i, j)]
-                else:
-                    self.cells[i][j].prediction = 0
+                if self.cells[i][j].type == 1:
+                    self.add_prediction(i, j, 1)
+        self.predictions_ready = True
+
+    def update_prediction(self):
+        if not self.predictions_ready:
+            self.rebuild_predictions()
 
     def is_in_bounds(self, i, j):
         condition = i > 0 and i < self.dimX and j >= 0 and j < self.dimY
@@ -88,11 +214,12 @@ class Room:
             t = int(self.cells[indexX][indexY].type ==
                     0 or self.cells[indexX][indexY].type == 0)
             n = int(self.cells[indexX][indexY].type == 1)
-            u = self.get_potential(indexX, indexY)
+            u, best = self.get_attraction()
+            attraction = math.exp(self.alpha*(u[indexX][indexY]-best[i][j]))
             r_prime_tilde = self.get_indicator(i, j, dirX, dirY)
-            res = t * math.exp(self.alpha*u)*(1-self.beta*n) * \
+            res = t * attraction*(1-self.beta*n) * \
                 (1-self.gamma*r_prime_tilde)
-            return res
+            return max(res, 0)
         return 0
 
     def prob_condition(self, a, b, i, j):
@@ -112,107 +239,209 @@ class Room:
         if somme != 0:
             prob_dist = {c: dic[c]/somme for c in dic}
             return prob_dist
-        return {(0, 0) : 0}
-    def choose_dir(self, i, j):
+        return {(0, 0) : 1}
+    def key(self, i, j):
+        return i*self.dimY+j
+
+    def choose_dir(self, i, j, u=None):
         dic = self.get_probabilities(i, j)
-        sortieX, sortieY = self.closest_exit(i, j)
-        if abs(sortieX-i) + abs(sortieY-j) <= 2:
+        if self.get_floor_field().exit_shortcut()[i, j]:
+            sortieX, sortieY = self.closest_exit(i, j)
             return (sortieX-i, sortieY-j)
         if dic == {}:
             return (0, 0)
-        return random.choices(list(dic.keys()), weights=list(dic.values()), k=1)[0]
+        if u is None:
+            u = self.rng.uniform(DECIDE, self.tick, self.key(i, j))
+        directions = list(dic.keys())
+        return directions[inverse_cdf(list(dic.values()), u)]
+
+    def choose_dirs(self, cells):
+        draws = self.rng.uniforms(DECIDE, self.tick, [self.key(i, j) for (i, j) in cells])
+        return [self.choose_dir(i, j, u) for (i, j), u in zip(cells, draws.tolist())]
+
+    def bind(self, i, j, a, b):
+        # The agent in (i, j) waits for the agent in (a, b) to leave.
+        self.release(i, j)
+        self.cells[i][j].bound_to = [(a, b)]
+        self.blocked_by.setdefault((a, b), []).append((i, j))
+
+    def release(self, i, j):
+        for blocker in self.cells[i][j].bound_to:
+            bound = self.blocked_by.get(blocker)
+            if bound is not None and (i, j) in bound:
+                bound.remove((i, j))
+                if not bound:
+                    del self.blocked_by[blocker]
+        self.cells[i][j].bound_to = NO_CELLS
 
     def get_cells_bound_to(self, i, j):
-        L = []
-        for x in range(self.dimX):
-            for y in range(self.dimY):
-                if self.cells[x][y].type == 1 and self.cells[x][y].bound_to == (i, j):
-                    L.append((x, y))
-        return L
+        return [(x, y) for (x, y) in self.blocked_by.get((i, j), [])
+                if self.cells[x][y].type == 1]
+
+    def get_blocked_chain(self, i, j):
+        # Every agent queued behind (i, j), closest first.
+        chain = []
+        front = [(i, j)]
+        while front:
+            bound = []
+            for (x, y) in front:
+                bound += self.get_cells_bound_to(x, y)
+            chain += bound
+            front = bound
+        return chain
+
+    def get_agents(self):
+        return [((i, j), self.cells[i][j].next_update) for i in range(self.dimX)
+                for j in range(self.dimY) if self.cells[i][j].type == 1]
+
+    def sync_agents(self):
+        # Needed after the agents were placed by writing cell types directly.
+        self.rebuild_scheduler()
+        self.rebuild_predictions()
+
+    def rebuild_scheduler(self):
+        self.scheduler = AgentScheduler(self.get_agents())
 
     def get_agent_to_update(self):
-        dic = {}
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-                if self.cells[i][j].type == 1:
-                    nu = self.cells[i][j].next_update
-                    if nu in dic:
-                        dic[nu].append((i, j))
-                    else:
-                        dic[nu] = [(i, j)]
-        sorted_keys = list(dic.keys())
-        sorted_keys.sort()
-        if sorted_keys != []:
-            return dic[sorted_keys[0]]
-        return []
+        if self.scheduler is None:
+            self.rebuild_scheduler()
+        if self.synchronous:
+            # Parallel update: every agent decides from the same state at
+            # every tick, a tick lasts one time unit and the clocks of the
+            # agents are not used. The heap is not popped from: its stale
+            # entries are compacted here.
+            self.scheduler.drop_stale()
+            cohort = sorted(self.scheduler.entries)
+            if cohort:
+                self.time = float(self.tick)
+            return cohort
+        t, cohort = self.scheduler.peek_cohort()
+        if cohort:
+            self.time = t
+        return cohort
 
     def move_agent(self, i1, j1, i2, j2):
         if self.cells[i1][j1].type == 1 and self.cells[i2][j2].type in (0, 3):
-            self.cells[i1][j1].predicted_direction = (1, 0)
-            self.cells[i1][j1].prediction = 0
+            self.release(i1, j1)
+            if self.predictions_ready:
+                self.add_prediction(i1, j1, -1)
+            self.cells[i1][j1].predicted_direction = DEFAULT_DIRECTION
             self.cells[i1][j1].potential = 0
             self.cells[i1][j1].type = 0
     
-            self.cells[i2][j2].predicted_direction = (1, 0)
-            self.cells[i2][j2].prediction = 0
+            self.cells[i2][j2].predicted_direction = DEFAULT_DIRECTION
             self.cells[i2][j2].potential = 0
-            self.cells[i2][j2].next_update += 1+0.5*int(abs(i1-i2)+abs(j1-j2)>1)
+            # the agent keeps its own clock, plus the 3/2 diagonal penalty
+            self.cells[i2][j2].next_update = self.cells[i1][j1].next_update + \
+                1+0.5*int(abs(i1-i2)+abs(j1-j2)>1)
             if self.cells[i2][j2].type != 3:
                 self.cells[i2][j2].type = 1
-
-        # We also have to unbound everyone that was bound to the
-        # cell that was in i1, j1
+                if self.predictions_ready:
+                    self.add_prediction(i2, j2, 1)
+            if self.cells[i2][j2].type == 3:
+                self.exited += 1
+            if self.listeners:
+                self.notify("on_move", i1, j1, i2, j2, self.cells[i2][j2].type == 3)
+            if self.scheduler is not None:
+                if self.cells[i2][j2].type == 3:
+                    self.scheduler.remove((i1, j1))
+                else:
+                    self.scheduler.move((i1, j1), (i2, j2), self.cells[i2][j2].next_update)
+            return True
+        return False
 
     def unbound_cells(self, i, j):
-        bound_cells = self.get_cells_bound_to(i, j)
-        for (a, b) in bound_cells:
-            self.cells[a][b].bound_to = []
+        for (a, b) in self.blocked_by.pop((i, j), []):
+            self.cells[a][b].bound_to = NO_CELLS
 
     def resolve_conflict(self, i, j, l, depth=0):
-        max_depth = 4
-        if depth >= max_depth:
-            return True
-        rand_float = random.random()
-        if len(l) > 1:
-            if rand_float > self.mu:
+        # When an agent moves, the agents bound behind it compete for the
+        # cell it freed, and so on up the blocked chain.
+        while l and (self.max_depth is None or depth < self.max_depth):
+            if len(l) > 1:
+                self.conflicts += 1
+                refused = self.rng.uniform(REFUSE, self.tick, self.key(i, j)) <= self.mu
+                if self.listeners:
+                    self.notify("on_conflict", i, j, len(l), refused)
+                if refused:
+                    self.refused += 1
+                    break
                 # One agent is selected to move
-                sX, sY = random.choice(l)
-                self.move_agent(sX, sY, i, j)
-
-        elif len(l) == 1:
-            # No conflict, the agent moves to the empty cell.
-            a, b = l[0]
-            self.move_agent(i, j, a, b)
-            self.resolve_conflict(i, j, self.get_cells_bound_to(i, j), depth+1)
-            # maybe unbound here
-            self.unbound_cells(i, j)  # So is max recursion depth 1 ???
-        return True
+                sX, sY = min(l, key=lambda c: self.rng.uniform(PICK, self.tick, self.key(*c)))
+            else:
+                # No conflict, the agent moves to the empty cell.
+                sX, sY = l[0]
+            if not self.move_agent(sX, sY, i, j):
+                break
+            l = self.get_cells_bound_to(sX, sY)
+            self.unbound_cells(sX, sY)
+            i, j = sX, sY
+            depth += 1
+        return depth
 
     def update_cells(self):
         # decision process
         cells_to_update = self.get_agent_to_update()
         target_cells = []
         self.update_prediction()
-        for (i, j) in cells_to_update:
-            target_dirX, target_dirY = self.choose_dir(i, j)
-            
+        # Decisions only read the predictions of this tick, they can be
+        # taken for every agent at once.
+        directions = self.choose_dirs(cells_to_update)
+        for (i, j), (target_dirX, target_dirY) in zip(cells_to_update, directions):
             a, b = i + target_dirX, j + target_dirY
-            self.cells[i][j].predicted_direction = (
-                target_dirX, target_dirY)
-            if self.cells[i][j].type in (0, 3):
+            self.set_predicted_direction(i, j, (target_dirX, target_dirY))
+            self.release(i, j)
+            if (a, b) == (i, j):
+                continue
+            if self.cells[a][b].type in (0, 3):
                 target_cells.append((a, b))
-                self.cells[a][b].waiting_list.append((i, j))
-            elif self.cells[i][j].type == 1:
-                target_cells.append((a, b))
-                self.cells[i][j].bound_to = [(a, b)]
-                self.cells[a][b].waiting_list.append((i, j))
-
-                self.cells[i][j].bound_to = [(a, b)]
-        for i in range(self.dimX):
-            for j in range(self.dimY):
-        # for (i, j) in target_cells:
-                w_l = self.cells[i][j].waiting_list
-                self.resolve_conflict(i, j, w_l)
+                target = self.cells[a][b]
+                if target.waiting_list:
+                    target.waiting_list.append((i, j))
+                else:
+                    target.waiting_list = [(i, j)]
+            elif self.cells[a][b].type == 1:
+                # blocked: the agent follows if (a, b) is freed this tick
+                self.bind(i, j, a, b)
+        self.resolve_conflicts(target_cells)
+        if not self.synchronous:
+            # Agents who could not move try again one time unit later.
+            for (i, j) in cells_to_update:
+                if (i, j) in self.scheduler and self.scheduler.time_of((i, j)) == self.time:
+                    self.postpone(i, j, 1)
+        self.tick += 1
+        if self.listeners:
+            self.notify("on_tick", self)
+
+    def postpone(self, i, j, dt):
+        self.cells[i][j].next_update += dt
+        self.scheduler.add((i, j), self.cells[i][j].next_update)
+
+    def run_until(self, T, max_ticks=None):
+        # Steps the room until every remaining agent is scheduled after T.
+        # max_ticks bounds the number of steps.
+        ticks = 0
+        while max_ticks is None or ticks < max_ticks:
+            if self.scheduler is None:
+                self.rebuild_scheduler()
+            if not self.scheduler:
+                break
+            if self.synchronous:
+                if self.tick > T:
+                    break
+            elif self.scheduler.peek_time() > T:
+                break
+            self.update_cells()
+            ticks += 1
+        return ticks
+
+    def resolve_conflicts(self, target_cells):
+        # Only the cells targeted this tick have a waiting list. The lists
+        # are emptied once solved.
+        for (i, j) in dict.fromkeys(target_cells):
+            w_l = self.cells[i][j].waiting_list
+            self.cells[i][j].waiting_list = NO_CELLS
+            self.resolve_conflict(i, j, w_l)
 
 
 ###TESTING
@@ -225,36 +454,31 @@ def populate(piece, n):
     piece.cells[int(piece.dimX-3)][int(piece.dimY/2)+1].type = 2
     piece.cells[int(piece.dimX-3)][int(piece.dimY/2)-1].type = 2
 
-    for _ in range(n):
-        i = random.randint(0, int(piece.dimX/2)-1)
-        j = random.randint(0, piece.dimY-1)
-        while piece.cells[i][j].type != 0:
-            i = random.randint(0, int(piece.dimX/2)-1)
-            j = random.randint(0, piece.dimY-1)
+    # n distinct free cells of the left half
+    free = np.argwhere(piece.get_types()[:int(piece.dimX/2)] == 0)
+    draws = piece.rng.uniforms(PLACE, 0, free[:, 0]*piece.dimY+free[:, 1])
+    for (i, j) in free[np.argsort(draws, kind="stable")[:n]]:
         piece.cells[i][j].type = 1
     for i in range(piece.dimY):
         if piece.cells[-1][i].type == 0:
             piece.cells[-1][i].type = 2
+    piece.update_floor_field()
+    piece.sync_agents()
 
 
 
 def test_model(iter, n):
+    from render import RoomView
     piece = Room()
     piece.initialize_cells()
-    # plt.figure()
     populate(piece, n)
-    arr = []
+    view = RoomView(piece.get_types())
     for _ in range(iter):
-        cter = 0
-        arr = get_array_to_display(piece)
-        for e in arr:
-            for c in e:
-                if c == 2:
-                    cter += 1
-        piece.update_cells()
-        plt.imshow(arr, cmap = 'binary')
-        plt.show()
-        if cter == 0:
+        if not piece.scheduler:
             break
-    
-test_model(1000, 100)
+        piece.update_cells()
+        view.update(piece.get_types())
+
+
+if __name__ == "__main__":
+    test_model(1000, 100)
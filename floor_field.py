@@ -0,0 +1,118 @@
+import heapq
+import math
+
+import numpy as np
+
+# Static floor field of a room: distance to the closest exit and the
+# associated potential. It only depends on the walls (2) and the exits (3),
+# so it is computed once per layout instead of once per neighbour query.
+
+ANISOTROPIC = "anisotropic"  # formula of Room.get_distance, ignores walls
+OBSTACLE = "obstacle"  # shortest path around the walls (Dijkstra)
+
+NEIGHBOURS = [(a, b) for a in range(-1, 2) for b in range(-1, 2) if (a, b) != (0, 0)]
+
+
+class FloorField:
+
+    def __init__(self, types, mode=ANISOTROPIC, diagonal_cost=1.5):
+        self.set_geometry(types, mode, diagonal_cost)
+        if mode == ANISOTROPIC:
+            self.nearest_exit = self.euclidean_nearest_exit()
+            self.distance = self.anisotropic_distance()
+        elif mode == OBSTACLE:
+            self.nearest_exit, self.distance = self.flood_distance()
+        else:
+            raise ValueError("unknown floor field mode: %r" % (mode,))
+
+    @classmethod
+    def from_arrays(cls, types, mode, distance, nearest_exit, diagonal_cost=1.5):
+        # Field computed earlier (see layout.Layout.save), nothing is redone.
+        ff = cls.__new__(cls)
+        ff.set_geometry(types, mode, diagonal_cost)
+        ff.distance = distance
+        ff.nearest_exit = nearest_exit
+        return ff
+
+    def set_geometry(self, types, mode, diagonal_cost):
+        types = np.asarray(types, dtype=np.int8)
+        self.dimX, self.dimY = types.shape
+        self.mode = mode
+        self.diagonal_cost = diagonal_cost
+        self.walls = types == 2
+        self.shortcut = None  # see exit_shortcut
+        # Exits are listed in the order closest_exit used to scan the grid.
+        self.exits = [(int(x), int(y)) for x, y in np.argwhere(types == 3)]
+
+    def euclidean_nearest_exit(self):
+        nearest = np.zeros((self.dimX, self.dimY, 2), dtype=np.int64)
+        min_d = np.full((self.dimX, self.dimY), np.inf)
+        X, Y = np.indices((self.dimX, self.dimY))
+        for (x, y) in self.exits:
+            d = np.sqrt((x-X)**2+(y-Y)**2)
+            # strict comparison keeps the first exit found, like the old scan
+            closer = d < min_d
+            min_d[closer] = d[closer]
+            nearest[closer] = (x, y)
+        return nearest
+
+    def anisotropic_distance(self):
+        X, Y = np.indices((self.dimX, self.dimY))
+        dX = self.nearest_exit[:, :, 0] - X
+        dY = self.nearest_exit[:, :, 1] - Y
+        abs_dX = np.abs(dX).astype(float)
+        quotient = np.divide(10*dY**2, abs_dX, out=np.zeros_like(abs_dX),
+                             where=abs_dX != 0)
+        return np.where(dX != 0, np.sqrt(quotient+dX**2), 0.0)
+
+    def flood_distance(self):
+        # Multi-source Dijkstra from every exit, walls are not crossable.
+        dimX, dimY = self.dimX, self.dimY
+        walls = self.walls.tolist()
+        dist = [[math.inf]*dimY for _ in range(dimX)]
+        source = [[(0, 0)]*dimY for _ in range(dimX)]
+        heap = []
+        for (x, y) in self.exits:
+            dist[x][y] = 0.0
+            source[x][y] = (x, y)
+            heap.append((0.0, x, y))
+        heapq.heapify(heap)
+        steps = [(a, b, self.diagonal_cost if a != 0 and b != 0 else 1.0)
+                 for (a, b) in NEIGHBOURS]
+        while heap:
+            d, x, y = heapq.heappop(heap)
+            if d > dist[x][y]:
+                continue
+            for (a, b, cost) in steps:
+                nx, ny = x+a, y+b
+                if 0 <= nx < dimX and 0 <= ny < dimY and not walls[nx][ny]:
+                    nd = d+cost
+                    if nd < dist[nx][ny]:
+                        dist[nx][ny] = nd
+                        source[nx][ny] = source[x][y]
+                        heapq.heappush(heap, (nd, nx, ny))
+        return np.array(source, dtype=np.int64).reshape(dimX, dimY, 2), np.array(dist)
+
+    def closest_exit(self, i, j):
+        x, y = self.nearest_exit[i, j]
+        return (int(x), int(y))
+
+    def get_distance(self, i, j):
+        return float(self.distance[i, j])
+
+    def exit_shortcut(self):
+        # (dimX, dimY) booleans: cells whose agent walks straight into its
+        # nearest exit (Manhattan distance 2 at most, not across a wall)
+        if self.shortcut is None:
+            X, Y = np.indices((self.dimX, self.dimY))
+            dX = self.nearest_exit[:, :, 0]-X
+            dY = self.nearest_exit[:, :, 1]-Y
+            shortcut = (np.abs(dX)+np.abs(dY) <= 2) & np.isfinite(self.distance)
+            # two cells in a line: the cell in between must not be a wall
+            middle = self.walls[np.clip(X+dX//2, 0, self.dimX-1), np.clip(Y+dY//2, 0, self.dimY-1)]
+            straight = (np.abs(dX) == 2) | (np.abs(dY) == 2)
+            self.shortcut = shortcut & ~(straight & middle)
+        return self.shortcut
+
+    def potential(self, potential_strength):
+        return -potential_strength*self.distance
@@ -1,10 +1,20 @@
-from tkinter import *
-from tkinter import ttk
+import time
 
-root = Tk()
-root.title("TIPE")
-label = ttk.Label(root, text = "TIPE")
-label.pack()
-root.mainloop()
+from evac import Room, populate
+from monitor import Monitor
 
+# The browser shows the last frame 25 times per second, the simulation never
+# waits for it (see monitor.py).
+piece = Room()
+piece.initialize_cells()
+populate(piece, 100)
+piece.enable_profiling()
 
+with Monitor(port=8765, fps=25) as monitor:
+    monitor.watch(piece, "TIPE")
+    print("TIPE :", monitor.url())
+    while piece.scheduler:
+        piece.update_cells()
+        time.sleep(0.05)
+    monitor.push(piece)
+    input("évacuation terminée, Entrée pour quitter")
@@ -0,0 +1,120 @@
+import numpy as np
+
+# Batched version of Room.get_unnormalized_prob / get_probabilities /
+# choose_dir: the 9 neighbour weights t*exp(alpha*u)*(1-beta*n)*(1-gamma*r)
+# of every active agent are computed at once as a (agents x 9) matrix.
+# exp(alpha*u) is computed for the active agents only, from the potential
+# u = -potential_strength*distance of the floor field (see attraction).
+# With `replicas` (replica index of every agent), types, prediction and
+# predicted_direction have a leading replica axis (ensemble.Ensemble), the
+# walls and the potential are shared.
+
+# Same order as the dictionary built by Room.get_probabilities.
+DIRECTIONS = np.array([(a, b) for a in range(-1, 2) for b in range(-1, 2)])
+STAY = 4  # index of (0, 0)
+
+
+def neighbour_indices(agents, dimX, dimY):
+    agents = np.asarray(agents, dtype=np.int64).reshape(-1, 2)
+    tX = agents[:, 0, None]+DIRECTIONS[None, :, 0]
+    tY = agents[:, 1, None]+DIRECTIONS[None, :, 1]
+    # same bounds as Room.is_in_bounds
+    inside = (tX > 0) & (tX < dimX) & (tY >= 0) & (tY < dimY)
+    return agents, np.where(inside, tX, 0), np.where(inside, tY, 0), inside
+
+
+def lookup(array, replicas, x, y):
+    if replicas is None:
+        return array[x, y]
+    return array[replicas.reshape(replicas.shape+(1,)*(x.ndim-1)), x, y]
+
+
+def best_neighbour(walls, potential):
+    # (dimX, dimY): the largest u among the moves allowed from every cell
+    # (in bounds, not into a wall, u finite), 0 when there is none. Room
+    # takes exp(alpha*u) relative to it, like attraction.
+    dimX, dimY = walls.shape
+    padded = np.full((dimX+2, dimY+2), -np.inf)
+    padded[1:-1, 1:-1] = np.where(walls, -np.inf, potential)
+    padded[1, :] = -np.inf  # column 0 is out of bounds (Room.is_in_bounds)
+    padded[np.isnan(padded)] = -np.inf
+    best = np.full((dimX, dimY), -np.inf)
+    for k, (a, b) in enumerate(DIRECTIONS):
+        if k != STAY:
+            np.maximum(best, padded[1+a:1+a+dimX, 1+b:1+b+dimY], out=best)
+    best[~np.isfinite(best)] = 0
+    return best
+
+
+def attraction(walls, potential, alpha, tX, tY, inside):
+    # (agents, 9): exp(alpha*u) of the neighbours of the agents, 0 for the
+    # moves Room.prob_condition never allows ((0, 0), walls and out of bounds
+    # cells). Only the cohort is computed, from the (dimX, dimY) potential:
+    # a table of the 9 weights of every cell would cost 72 bytes per cell.
+    u = potential[tX, tY]
+    allowed = inside & ~walls[tX, tY] & np.isfinite(u)
+    allowed[:, STAY] = False
+    # exp(alpha*u) is taken relative to the best neighbour of each agent
+    # (best_neighbour), the common factor cancels out in the normalisation
+    # and large rooms do not underflow to zero.
+    u_max = np.max(np.where(allowed, u, -np.inf), axis=1, keepdims=True)
+    u_max[~np.isfinite(u_max)] = 0
+    return np.where(allowed, np.exp(alpha*(np.where(allowed, u, u_max)-u_max)), 0.0)
+
+
+def transition_weights(types, walls, potential, prediction, predicted_direction,
+                       agents, alpha, beta, gamma, replicas=None):
+    dimX, dimY = types.shape[-2:]
+    agents, tX, tY, inside = neighbour_indices(agents, dimX, dimY)
+    target = lookup(types, replicas, tX, tY)
+    t = target == 0
+    n = target == 1
+    own = lookup(predicted_direction, replicas, agents[:, 0], agents[:, 1])
+    same_dir = (DIRECTIONS[None, :, 0] == own[:, 0, None]) & \
+        (DIRECTIONS[None, :, 1] == own[:, 1, None])
+    is_agent = lookup(types, replicas, agents[:, 0], agents[:, 1]) == 1
+    r_prime_tilde = np.where(inside & is_agent[:, None],
+                             lookup(prediction, replicas, tX, tY)-same_dir, 0)
+    static = attraction(walls, potential, alpha, tX, tY, inside)
+    # r_prime_tilde can exceed 1/gamma: no negative weight, the cumulative sum
+    # has to stay monotone for inverse_cdf
+    weights = np.maximum(t*static*(1-beta*n)*(1-gamma*r_prime_tilde), 0)
+    weights[~is_agent] = 0
+    return weights
+
+
+def transition_probabilities(types, walls, potential, prediction, predicted_direction,
+                             agents, alpha, beta, gamma, replicas=None):
+    weights = transition_weights(types, walls, potential, prediction, predicted_direction,
+                                 agents, alpha, beta, gamma, replicas)
+    total = weights.sum(axis=1, keepdims=True)
+    probs = np.divide(weights, total, out=np.zeros_like(weights), where=total != 0)
+    # nothing reachable: the agent stays where it is
+    probs[total[:, 0] == 0, STAY] = 1
+    return probs
+
+
+def inverse_cdf(probs, draws):
+    # draws: one uniform in [0, 1) per row, same rule as rng.inverse_cdf.
+    cumulative = np.cumsum(probs, axis=1)
+    index = (cumulative <= (draws*cumulative[:, -1])[:, None]).sum(axis=1)
+    return np.minimum(index, len(DIRECTIONS)-1)
+
+
+def exit_override(directions, agents, nearest_exit, shortcut):
+    # Agents next to an exit walk straight into it (Room.choose_dir),
+    # shortcut: FloorField.exit_shortcut
+    to_exit = nearest_exit[agents[:, 0], agents[:, 1]]-agents
+    near = shortcut[agents[:, 0], agents[:, 1]]
+    directions[near] = to_exit[near]
+    return directions
+
+
+def choose_directions(types, walls, potential, prediction, predicted_direction,
+                      nearest_exit, shortcut, agents, alpha, beta, gamma, draws):
+    # draws: one uniform per agent
+    agents = np.asarray(agents, dtype=np.int64).reshape(-1, 2)
+    probs = transition_probabilities(types, walls, potential, prediction, predicted_direction,
+                                     agents, alpha, beta, gamma)
+    directions = DIRECTIONS[inverse_cdf(probs, draws)]
+    return exit_override(directions, agents, nearest_exit, shortcut)
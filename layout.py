@@ -0,0 +1,128 @@
+import argparse
+
+import numpy as np
+
+from floor_field import ANISOTROPIC, OBSTACLE, FloorField
+from rng import PLACE
+
+# Room geometries read from a text map or an image, compiled once into the
+# grid, the exit list and the floor field. A compiled layout can be saved to
+# a .npz file and loaded back without recomputing anything.
+#
+# Text maps have one line per row (y), one character per cell (x):
+#   .  floor      #  wall      X  obstacle (a wall)
+#   E  exit       A  agent standing on the floor
+# Images: dark pixels are walls, green pixels exits, red pixels agents,
+# everything else is floor.
+
+SYMBOLS = {".": 0, " ": 0, "#": 2, "X": 2, "E": 3, "A": 1}
+
+
+class Layout:
+
+    def __init__(self, types, mode=ANISOTROPIC, floor_field=None):
+        types = np.asarray(types, dtype=np.int8)
+        self.dimX, self.dimY = types.shape
+        self.agents = [(int(i), int(j)) for (i, j) in np.argwhere(types == 1)]
+        # static part of the grid, agents are only initial positions
+        self.types = np.where(types == 1, 0, types).astype(np.int8)
+        self.exits = [(int(i), int(j)) for (i, j) in np.argwhere(self.types == 3)]
+        if floor_field is None:
+            floor_field = FloorField(self.types, mode)
+        self.floor_field = floor_field
+
+    def initial_types(self):
+        types = self.types.copy()
+        for (i, j) in self.agents:
+            types[i, j] = 1
+        return types
+
+    def build_room(self, cls=None):
+        if cls is None:
+            from evac import Room
+            cls = Room
+        room = cls()
+        room.apply_layout(self)
+        return room
+
+    def to_ascii(self):
+        chars = {0: ".", 1: "A", 2: "#", 3: "E"}
+        types = self.initial_types()
+        return "\n".join("".join(chars[int(types[i, j])] for i in range(self.dimX))
+                         for j in range(self.dimY))
+
+    def save(self, path):
+        ff = self.floor_field
+        np.savez(path, types=self.initial_types(), mode=ff.mode,
+                 diagonal_cost=ff.diagonal_cost, distance=ff.distance,
+                 nearest_exit=ff.nearest_exit)
+
+
+def from_ascii(text, mode=ANISOTROPIC):
+    lines = [line.rstrip("\n") for line in text.split("\n")]
+    while lines and not lines[-1].strip():
+        lines.pop()
+    width = max(len(line) for line in lines)
+    types = np.zeros((width, len(lines)), dtype=np.int8)
+    for j, line in enumerate(lines):
+        for i, c in enumerate(line):
+            if c not in SYMBOLS:
+                raise ValueError("unknown symbol %r at line %d, column %d" % (c, j+1, i+1))
+            types[i, j] = SYMBOLS[c]
+    return Layout(types, mode)
+
+
+def from_image(path, mode=ANISOTROPIC):
+    from PIL import Image
+    rgb = np.asarray(Image.open(path).convert("RGB"), dtype=float)/255
+    r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+    types = np.zeros(r.shape, dtype=np.int8)
+    types[(r+g+b)/3 < 0.25] = 2
+    types[(g > 0.5) & (r < 0.5) & (b < 0.5)] = 3
+    types[(r > 0.5) & (g < 0.5) & (b < 0.5)] = 1
+    # image rows are y, the grid is indexed [x, y]
+    return Layout(types.T, mode)
+
+
+def populate(room, n):
+    # evac.populate for a room built from a layout: n agents on distinct
+    # floor cells from which an exit can be reached, drawn with room.rng.
+    # The walls and the exits of the layout are left as they are.
+    ff = room.get_floor_field()
+    free = np.argwhere((room.get_types() == 0) & np.isfinite(ff.distance))
+    if n > len(free):
+        raise ValueError("%d agents for %d free cells" % (n, len(free)))
+    draws = room.rng.uniforms(PLACE, 0, free[:, 0]*room.dimY+free[:, 1])
+    for (i, j) in free[np.argsort(draws, kind="stable")[:n]]:
+        room.cells[i][j].type = 1
+    room.sync_agents()
+
+
+def load(path, mode=ANISOTROPIC):
+    if path.endswith(".npz"):
+        data = np.load(path)
+        types = data["types"]
+        ff = FloorField.from_arrays(np.where(types == 1, 0, types), str(data["mode"]),
+                                    data["distance"], data["nearest_exit"],
+                                    float(data["diagonal_cost"]))
+        return Layout(types, ff.mode, ff)
+    if path.endswith(".txt") or path.endswith(".map"):
+        with open(path) as f:
+            return from_ascii(f.read(), mode)
+    return from_image(path, mode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a room layout to .npz.")
+    parser.add_argument("source", help="text map (.txt, .map) or image")
+    parser.add_argument("output", help=".npz file")
+    parser.add_argument("--mode", choices=[ANISOTROPIC, OBSTACLE], default=ANISOTROPIC)
+    args = parser.parse_args(argv)
+    layout = load(args.source, args.mode)
+    layout.save(args.output)
+    print("%dx%d, %d exits, %d agents" % (layout.dimX, layout.dimY,
+                                          len(layout.exits), len(layout.agents)))
+
+
+if __name__ == "__main__":
+    main()
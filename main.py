@@ -8,11 +8,21 @@
 #####################################################
 
 import math
-import random
-import matplotlib.pyplot as plt
+from collections import namedtuple
+import numpy as np
+
+from recorder import TrajectoryReader, TrajectoryRecorder
+from rng import DECIDE, PICK, PLACE, REFUSE, CounterRNG, inverse_cdf
+from scheduler import AgentScheduler
+
+
+NO_CELLS = ()  # listes vides partagées, remplacées par une liste au premier ajout
 
 
 class Cell:
+    __slots__ = ("i", "j", "n", "potential", "prediction", "predicted_direction",
+                 "is_blocker_of", "bound_to", "next_update", "waiting_list")
+
     def __init__(self, i, j):
         self.i = i
         self.j = j
@@ -20,25 +30,34 @@ class Cell:
         self.potential = 0
         self.prediction = 0
         self.predicted_direction = (1, 0)
-        self.is_blocker_of = []
-        self.bound_to = []
+        self.is_blocker_of = NO_CELLS
+        self.bound_to = NO_CELLS
         self.next_update = 0.0
-        self.waiting_list = []
+        self.waiting_list = NO_CELLS
 
     def get_probability(self, d):
         return 0
 
 
+class Direction(namedtuple("Direction", ("i", "j"))):
+    # vecteur de déplacement, immuable et créé une seule fois
+    __slots__ = ()
+
+
+DIRECTIONS = {(i, j): Direction(i, j) for i in range(-1, 2) for j in range(-1, 2)}
+
+
 def get_reaction_surrounding():
-    return [[Cell(-1, 1), Cell(0, 1), Cell(1, 1)], [Cell(-1, 0), None, Cell(1, 0)], [Cell(-1, -1), Cell(0, -1), Cell(1, -1)]]
+    d = DIRECTIONS
+    return [[d[(-1, 1)], d[(0, 1)], d[(1, 1)]], [d[(-1, 0)], None, d[(1, 0)]], [d[(-1, -1)], d[(0, -1)], d[(1, -1)]]]
 
 
 class room():
 
-    def __init__(self):
+    def __init__(self, dimensions=(13, 7)):
         self.total_n_of_persons = 10
         self.potential_strength = 3
-        self.dimensions = (13, 7)
+        self.dimensions = dimensions
         self.sortie = (self.dimensions[0]-1, int(self.dimensions[1]/2))
         self.exit = Cell(self.sortie[0], self.sortie[1])
         self.cells = {(i, j): Cell(i, j) for i in range(
@@ -51,6 +70,14 @@ class room():
         self.mu = 0.5
         self.time_unit = 0.7
         self.period = 1
+        self.scheduler = None
+        self.tick = 0
+        self.rng = CounterRNG()  # tirages indexés par (tick, case), voir rng.py
+        self.attraction = {}  # exp(alpha*u) de chaque case, voir get_attraction
+        self.attraction_source = None
+
+    def key(self, i, j):
+        return i*self.dimensions[1]+j
 
     def add_cells(self, c1, c2):
         if c1 == None:
@@ -70,24 +97,31 @@ class room():
         return math.sqrt(10*(self.exit.j-x.j)**2/(self.exit.i-x.i)+(self.exit.i-x.i)**2)
     def get_potential(self, x):
         return -self.potential_strength*self.get_distance(x)
+    def get_attraction(self, x):
+        # exp(alpha*u) ne dépend que de la géométrie : calculé une fois, et de
+        # nouveau seulement si alpha ou potential_strength changent
+        if self.attraction_source != (self.alpha, self.potential_strength):
+            self.attraction = {k: math.exp(self.alpha*self.get_potential(c)) for k, c in self.cells.items()}
+            self.attraction_source = (self.alpha, self.potential_strength)
+        return self.attraction[(x.i, x.j)]
     def get_indicator(self, x, d):
         r = self.cells[self.add_cells(x, d)].prediction
         return r == int((d.i, d.j) == x.predicted_direction)
 
     def get_unnormalized_prob(self, x, d):
-        if x.i != 12:
+        if x.i != self.sortie[0]:
             index = self.add_cells(x, d)
             if index in self.cells.keys():
                 target = self.cells[index]
                 t = 1
                 if target.n not in (0, 3):
                     t = 0
-                u = self.get_potential(target)
+                attraction = self.get_attraction(target)
                 n = target.n
                 if n > 1:
                     n = 0
                 r_prime = self.get_indicator(x, d)
-                return t * math.exp(self.alpha*u)*(1-self.beta*n)*(1-self.gamma*r_prime)
+                return max(t * attraction*(1-self.beta*n)*(1-self.gamma*r_prime), 0)
             else:
                 return 0
         else:
@@ -95,8 +129,8 @@ class room():
 
     def get_probabilities(self, x):
       
-        dic = {(i, j): self.get_unnormalized_prob(x, Cell(i, j))
-               for i in range(-1, 2) for j in range(-1, 2) if (i != j or i != 0 and self.get_unnormalized_prob(x, Cell(i, j)) > 0)}
+        dic = {(i, j): self.get_unnormalized_prob(x, DIRECTIONS[(i, j)])
+               for i in range(-1, 2) for j in range(-1, 2) if (i != j or i != 0 and self.get_unnormalized_prob(x, DIRECTIONS[(i, j)]) > 0)}
         inv_N = 0
         for k in dic:
             inv_N += dic[k]
@@ -108,54 +142,54 @@ class room():
 
     def get_agent_to_update(self):
         # Selection of active agents
-        dic = {}
-        for k in self.cells:
-            c = self.cells[k]
-            if c.n == 1:
-                if c.next_update in dic:
-                    dic[c.next_update].append((c.i, c.j))
-                else:
-                    dic[c.next_update] = [(c.i, c.j)]
-        min_k = float("inf")
-        for k in dic:
-            if k < min_k:
-                min_k = k
-        if min_k == float("inf"):
-            return []
-        return dic[min_k]
+        if self.scheduler is None:
+            self.scheduler = AgentScheduler(
+                [(k, self.cells[k].next_update) for k in self.cells if self.cells[k].n == 1])
+        return self.scheduler.peek_cohort()[1]
+
+    def reschedule(self, src, dst):
+        # The agent of src moved to dst, dst already holds its next_update.
+        if self.scheduler is not None:
+            if dst == self.sortie:
+                self.scheduler.remove(src)
+            else:
+                self.scheduler.move(src, dst, self.cells[dst].next_update)
 
     def choose_dir(self, c):
         if abs(c.i - self.exit.i) == 1 and (c.j - self.exit.j) >= 1:
-            return Cell(0, -1)
+            return DIRECTIONS[(0, -1)]
         if abs(c.i - self.exit.i) == 1 and (c.j - self.exit.j) <= -1:
-            return Cell(0, 1)
+            return DIRECTIONS[(0, 1)]
         if abs(c.i - self.exit.i) == 1 and (c.j - self.exit.j) == 0:
-            return Cell(1, 0)
-        prob_res = 1000
+            return DIRECTIONS[(1, 0)]
         probabilities = self.get_probabilities(c)
-        last_prob = 0
-        dic_of_probs = {}
-        for k in probabilities:
-            last_prob += probabilities[k]
-            dic_of_probs[int(prob_res*last_prob)] = k
-        rand_n = random.randint(0, prob_res)
-        closest_k = None
-        for k in dic_of_probs:
-            if closest_k == None:
-                closest_k = k
-            elif abs(k-rand_n) < abs(closest_k-rand_n):
-                closest_k = k
-        a, b = dic_of_probs[closest_k]
-        return Cell(a, b)
+        u = self.rng.uniform(DECIDE, self.tick, self.key(c.i, c.j))
+        a, b = list(probabilities)[inverse_cdf(list(probabilities.values()), u)]
+        return DIRECTIONS[(a, b)]
 
     def get_cells_bound_to(self, c):
-        L = []
-        for i, j in self.cells:
-            cell = self.cells[(i, j)]
-            if i != c.i and j != c.j:
-                if cell.bound_to == (c.i, c.j):
-                    L.append((i, j))
-        return L
+        # is_blocker_of is the reverse index of bound_to
+        return [k for k in c.is_blocker_of if self.cells[k].bound_to == [(c.i, c.j)]]
+
+    def bind(self, k, blocker):
+        # l'agent de k attend celui de blocker, les deux index restent à jour
+        self.release(k)
+        b = self.cells[blocker]
+        if b.is_blocker_of:
+            b.is_blocker_of.append(k)
+        else:
+            b.is_blocker_of = [k]
+        self.cells[k].bound_to = [blocker]
+
+    def release(self, k):
+        c = self.cells[k]
+        for blocker in c.bound_to:
+            b = self.cells[blocker]
+            if k in b.is_blocker_of:
+                b.is_blocker_of.remove(k)
+                if not b.is_blocker_of:
+                    b.is_blocker_of = NO_CELLS
+        c.bound_to = NO_CELLS
     
     def resolve_conflict(self, i, j, w_l):
         penalty = 1
@@ -172,14 +206,14 @@ class room():
                         if abs(ag.i - i) + abs(ag.j - j) >= 2:
                             penalty = 3/2
                         self.cells[(i, j)].next_update = ag.next_update+self.period*penalty
+                    self.reschedule(w_l[0], (i, j))
             elif len(w_l) > 1:
-                proba = random.randint(0, 1000)
-                if proba <= self.mu * 1000:
+                if self.rng.uniform(REFUSE, self.tick, self.key(i, j)) <= self.mu:
                     #disable all agents movement
                     pass
                 else:
                     #choose one random agent to move
-                    random_agent_index = w_l[random.randint(0, len(w_l)-1)]
+                    random_agent_index = min(w_l, key=lambda k: self.rng.uniform(PICK, self.tick, self.key(*k)))
                     random_agent = self.cells[random_agent_index]
                     if self.cells[random_agent_index].n == 1:
                         self.cells[random_agent_index].n = 0
@@ -188,6 +222,7 @@ class room():
                         self.cells[(i, j)].next_update = random_agent.next_update+self.period*penalty
                         if (i, j) != self.sortie:
                             self.cells[(i, j)].n = 1
+                        self.reschedule(random_agent_index, (i, j))
                     #Implementing 3/2 penalty for diagonal movement
                     
                     #random_agent moved so we have to unbound every cell that
@@ -196,47 +231,54 @@ class room():
                     #will be implemented later.
                     
                     
-                    if random_agent.is_blocker_of != []:
-                        ag = random_agent.is_blocker_of[0]
-                        random_agent.is_blocker_of = random_agent.is_blocker_of[1:]
+                    followers = self.get_cells_bound_to(random_agent)
+                    if followers:
+                        ag = followers[0]
+                        self.release(ag)
                         if self.cells[ag].n == 1:
                             self.cells[ag].n = 0
                             self.cells[random_agent_index].n = 1
                             self.cells[random_agent_index].next_update = self.cells[ag].next_update + self.period * penalty
+                            self.reschedule(ag, random_agent_index)
                     
                     
-                    for cell_to_unbound_index in random_agent.is_blocker_of:
-                        if cell_to_unbound_index in self.cells.keys():
-                            self.cells[cell_to_unbound_index].bound_to = []
-                    if random_agent_index in self.cells.keys():
-                        self.cells[random_agent_index].is_blocker_of = []
-                        #Resetting waiting list of random_agent cell
-                        self.cells[random_agent_index].waiting_list = []
+                    for cell_to_unbound_index in list(random_agent.is_blocker_of):
+                        self.release(cell_to_unbound_index)
+                    #Resetting waiting list of random_agent cell
+                    self.cells[random_agent_index].waiting_list = NO_CELLS
     
     def update_cells(self):
         cell_array = self.get_agent_to_update()
+        t = self.scheduler.peek_time()
         # Decision process
         penalty = 1
+        targets = []
         for (i, j) in cell_array:
             c = self.cells[(i, j)]
             # unbounding cellls bound to c as c is updating
             cells_bound_to = self.get_cells_bound_to(c)
-            for (ci, cj) in cells_bound_to:
-                self.cells[(ci, cj)].bound_to = []
+            for k in cells_bound_to:
+                self.release(k)
+            self.release((i, j))
             target_dir = self.choose_dir(c)
             self.cells[(i, j)].predicted_direction = (target_dir.i, target_dir.j)
             a, b = self.add_cells(c, target_dir)
             
             if (a, b) in self.cells.keys():
-                if self.cells[(a, b)].n in (0, 3):
-                    self.cells[(a, b)].waiting_list.append((i, j))
+                target = self.cells[(a, b)]
+                if target.n in (0, 3):
+                    if target.waiting_list:
+                        target.waiting_list.append((i, j))
+                    else:
+                        target.waiting_list = [(i, j)]
+                    targets.append((a, b))
                 else:
-                    self.cells[(a, b)].is_blocker_of.append((i, j))
-                    self.cells[(i, j)].bound_to = [(a, b)]
+                    self.bind((i, j), (a, b))
         
-        #Conflict solution and motion
-        for (i, j) in self.cells:
+        #Conflict solution and motion, only on the cells targeted this tick
+        for (i, j) in dict.fromkeys(targets):
             w_l = self.cells[(i, j)].waiting_list
+            self.cells[(i, j)].waiting_list = NO_CELLS
             self.resolve_conflict(i, j, w_l)
             #self.resolve_conflict(i, j, w_l_2)
             # current_cell = self.cells[(i, j)]
@@ -282,23 +324,24 @@ class room():
             #     pass
 
             
-            for a in range(self.dimensions[1]):
-                self.cells[(self.dimensions[0]-1, a)].n = 2
-            self.cells[self.sortie].n = 3
             # self.cells[(i, j)].next_update += self.period * penalty
             
         for a in range(self.dimensions[1]):
             self.cells[(self.dimensions[0]-1, a)].n = 2
         self.cells[self.sortie].n = 3
+        # Agents who could not move try again one period later.
+        for k in cell_array:
+            if k in self.scheduler and self.scheduler.time_of(k) == t:
+                self.cells[k].next_update += self.period
+                self.scheduler.add(k, self.cells[k].next_update)
+        self.tick += 1
 def populate(room, n):
     room.total_n_of_persons = n
-    for _ in range(n):
-        i = random.randint(0, int(room.dimensions[0]/2)-1)
-        j = random.randint(0, room.dimensions[1]-1)
-        while room.cells[(i, j)].n == 1 and (i, j) != room.exit:
-            i = random.randint(0, int(room.dimensions[0]/2)-1)
-            j = random.randint(0, room.dimensions[1]-1)
-        room.cells[(i, j)].n = 1
+    free = [(i, j) for i in range(int(room.dimensions[0]/2))
+            for j in range(room.dimensions[1]) if room.cells[(i, j)].n != 1]
+    draws = room.rng.uniforms(PLACE, 0, [room.key(i, j) for (i, j) in free])
+    for k in np.argsort(draws, kind="stable")[:n]:
+        room.cells[free[k]].n = 1
     for i in range(room.dimensions[1]):
         room.cells[(room.dimensions[0]-1, i)].n = 2
 
@@ -306,37 +349,49 @@ def populate(room, n):
 def get_array_to_display(room):
     return [[(room.cells[(i, j)].n==0) for i in range(room.dimensions[0])]for j in range(room.dimensions[1])]
 
+def get_types(room):
+    return np.array([[room.cells[(i, j)].n for j in range(room.dimensions[1])] for i in range(room.dimensions[0])])
+
 ## TESTING THE MODEL
-piece = room()
-populate(piece, 10)
-piece.cells[piece.sortie].n = 3
-arr = get_array_to_display(piece)
-result = []
-prev_arr = arr
-#plt.imshow(arr, cmap = 'binary', )
-
-
-for _ in range(1000):
-    cter = 0
-    for c in piece.cells:
-        if piece.cells[c].n == 1:
-            cter+=1
-    #plt.figure()
+def test_model(iter, n):
+    piece = room()
+    populate(piece, n)
+    piece.cells[piece.sortie].n = 3
     arr = get_array_to_display(piece)
-    
-        
-    result.append(arr)
-    
-    #plt.imshow(arr, cmap = 'binary')
-    piece.update_cells()
-    # plt.pause(0.01)
-    # print(cter)
-    if cter == 0:
-        break
+    # The frames are streamed to disk instead of kept in a list
+    recorder = TrajectoryRecorder("main_trajectory")
     prev_arr = arr
+    #plt.imshow(arr, cmap = 'binary', )
+
+
+    for _ in range(iter):
+        # le scheduler contient les agents encore dans la salle
+        cter = len(piece.scheduler) if piece.scheduler is not None else piece.total_n_of_persons
+        #plt.figure()
+        arr = get_array_to_display(piece)
+
+
+        recorder.add_frame(get_types(piece))
+
+        #plt.imshow(arr, cmap = 'binary')
+        piece.update_cells()
+        # plt.pause(0.01)
+        # print(cter)
+        if cter == 0:
+            break
+        prev_arr = arr
+
+
+    recorder.close()
+
+    from render import RoomView  # matplotlib seulement pour l'affichage
+    view = None
+    for types in TrajectoryReader("main_trajectory"):
+        if view is None:
+            view = RoomView(types)
+        else:
+            view.update(types)
 
 
-plt.figure()
-for arr in result:
-    plt.imshow(arr, cmap = 'binary')
-    plt.show()
+if __name__ == "__main__":
+    test_model(1000, 10)
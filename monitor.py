@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+from evac import RoomListener
+
+# Live view of a running room in a browser, on localhost and with the
+# standard library only (asyncio HTTP + WebSocket server):
+#   monitor = Monitor(port=8765).start()
+#   monitor.watch(room)
+#   ... room.update_cells() ...
+#   monitor.close()
+# then open http://127.0.0.1:8765/. The server runs in its own thread. At
+# most `fps` times per second the room stores a downsampled frame and wakes
+# the server up, it never waits for it: every client has a queue of
+# `queue_size` frames and a client too slow to empty it loses its oldest
+# frames (counted in "dropped").
+#   GET /        page drawing the frames
+#   GET /frame   last frame, JSON
+#   GET /ws      WebSocket, one JSON frame per message
+# A frame: tick, time, remaining agents, exited, outflow (agents exited at
+# each tick since the previous frame), the profiling counters of the room
+# (Room.enable_profiling) and the grid in blocks of block x block cells:
+# "occupancy" the share of agents of each block (0-255), "static" 2 for a
+# wall block, 3 for a block with an exit, both base64, x major.
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_SIDE = 128  # largest side of the downsampled grid
+OUTFLOW_KEPT = 1000  # ticks of outflow kept between two frames
+
+
+def downsample(types, block):
+    # (X/block, Y/block) blocks, the grid is padded with floor
+    dimX, dimY = types.shape
+    X, Y = -(-dimX//block), -(-dimY//block)
+    padded = np.zeros((X*block, Y*block), dtype=types.dtype)
+    padded[:dimX, :dimY] = types
+    return padded.reshape(X, block, Y, block).swapaxes(1, 2).reshape(X, Y, block*block)
+
+
+class Monitor(RoomListener):
+
+    def __init__(self, host="127.0.0.1", port=8765, fps=10, queue_size=4):
+        self.host = host
+        self.port = port  # 0 for any free port, see start
+        self.interval = 1/fps
+        self.queue_size = queue_size
+        self.room = None
+        self.label = None
+        self.lock = threading.Lock()
+        self.frame = None  # last frame of the room, taken by publish
+        self.pending = False  # a publish is scheduled on the server loop
+        self.message = None  # last frame sent, as JSON
+        self.last_frame = -float("inf")
+        self.exited = 0
+        self.outflow = collections.deque(maxlen=OUTFLOW_KEPT)
+        self.static_source = None
+        self.static = None
+        self.clients = set()
+        self.dropped = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    # simulation side
+
+    def watch(self, room, label=None):
+        # Follows `room` (and stops following the previous one).
+        if self.room is not None and self in self.room.listeners:
+            self.room.listeners.remove(self)
+        self.room = room
+        self.label = label
+        self.exited = room.exited
+        self.outflow.clear()
+        self.last_frame = -float("inf")
+        room.listeners.append(self)
+        self.push(room)
+
+    def on_tick(self, room):
+        self.outflow.append(room.exited-self.exited)
+        self.exited = room.exited
+        if time.monotonic()-self.last_frame >= self.interval:
+            self.push(room)
+
+    def push(self, room):
+        self.last_frame = time.monotonic()
+        frame = self.make_frame(room)
+        with self.lock:
+            self.frame = frame
+            wake = not self.pending
+            self.pending = True
+        if wake and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.publish)
+
+    def make_frame(self, room):
+        types = room.get_types()
+        block = max(1, -(-max(types.shape)//MAX_SIDE))
+        occupancy = (downsample(types, block) == 1).mean(axis=2)
+        ff = room.get_floor_field()
+        if self.static_source != (ff, block):
+            blocks = downsample(np.where(ff.walls, 2, types*(types == 3)), block)
+            self.static = np.where((blocks == 3).any(axis=2), 3,
+                                   np.where((blocks == 2).mean(axis=2) >= 0.5, 2, 0)).astype(np.uint8)
+            self.static_source = (ff, block)
+        frame = {
+            "label": self.label, "tick": room.tick, "time": room.time,
+            "remaining": int((types == 1).sum()), "exited": room.exited,
+            "conflicts": room.conflicts, "refused": room.refused,
+            "outflow": list(self.outflow),
+            "shape": occupancy.shape, "block": block,
+            "occupancy": base64.b64encode(np.rint(occupancy*255).astype(np.uint8).tobytes()).decode(),
+            "static": base64.b64encode(self.static.tobytes()).decode(),
+            "profiling": room.stats.as_dict() if room.stats is not None else None,
+        }
+        self.outflow.clear()
+        return frame
+
+    # server side, runs on self.loop
+
+    def publish(self):
+        with self.lock:
+            frame, self.pending = self.frame, False
+        frame["dropped"] = self.dropped
+        self.message = json.dumps(frame)
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(self.message)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode("latin-1").split("\r\n")
+            method, path = lines[0].split(" ")[:2]
+            headers = dict((k.strip().lower(), v.strip()) for k, _, v in
+                           (line.partition(":") for line in lines[1:] if line))
+            if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self.stream(reader, writer, headers["sec-websocket-key"])
+            elif path == "/frame":
+                self.respond(writer, "200 OK", "application/json", self.message or "{}")
+            elif path == "/":
+                self.respond(writer, "200 OK", "text/html; charset=utf-8", PAGE)
+            else:
+                self.respond(writer, "404 Not Found", "text/plain", "not found")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError,
+                KeyError, ValueError, asyncio.CancelledError):
+            # bad request, client gone or server closing
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, writer, status, content_type, body):
+        body = body.encode()
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                      "Cache-Control: no-store\r\nConnection: close\r\n\r\n"
+                      % (status, content_type, len(body))).encode()+body)
+
+    async def stream(self, reader, writer, key):
+        accept = base64.b64encode(hashlib.sha1(key.encode()+WS_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      "Connection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n" % accept).encode())
+        queue = asyncio.Queue(self.queue_size)
+        if self.message is not None:
+            queue.put_nowait(self.message)
+        self.clients.add(queue)
+        listening = asyncio.ensure_future(read_until_close(reader))
+        try:
+            while True:
+                sending = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait((sending, listening),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if listening in done:
+                    sending.cancel()
+                    break
+                writer.write(ws_frame(0x1, sending.result().encode()))
+                await writer.drain()
+            writer.write(ws_frame(0x8, b""))
+        finally:
+            self.clients.discard(queue)
+            listening.cancel()
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.serve, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def serve(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def url(self):
+        return "http://%s:%d/" % (self.host, self.port)
+
+    def close(self):
+        if self.room is not None and self in self.room.listeners:
+            self.room.listeners.remove(self)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ws_frame(opcode, payload):
+    # unmasked server frame
+    n = len(payload)
+    if n < 126:
+        head = struct.pack(">BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack(">BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack(">BBQ", 0x80 | opcode, 127, n)
+    return head+payload
+
+
+async def read_until_close(reader):
+    # The messages of the client are read and ignored, until it closes.
+    try:
+        while True:
+            head = await reader.readexactly(2)
+            n = head[1] & 0x7F
+            if n == 126:
+                n = struct.unpack(">H", await reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack(">Q", await reader.readexactly(8))[0]
+            await reader.readexactly(n+(4 if head[1] & 0x80 else 0))
+            if head[0] & 0x0F == 0x8:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Evacuation</title>
+<style>
+body { font-family: monospace; margin: 1em; }
+canvas { image-rendering: pixelated; border: 1px solid #888; }
+</style></head>
+<body>
+<div id="info">connecting...</div>
+<canvas id="grid"></canvas>
+<canvas id="flow" width="600" height="120"></canvas>
+<pre id="profiling"></pre>
+<script>
+const grid = document.getElementById("grid"), flow = document.getElementById("flow");
+const outflow = [];
+function bytes(b64) { return Uint8Array.from(atob(b64), c => c.charCodeAt(0)); }
+function draw(f) {
+  const [X, Y] = f.shape, scale = Math.max(1, Math.floor(600/Math.max(X, Y)));
+  grid.width = X*scale; grid.height = Y*scale;
+  const ctx = grid.getContext("2d"), img = ctx.createImageData(X, Y);
+  const occ = bytes(f.occupancy), st = bytes(f.static);
+  for (let x = 0; x < X; x++) for (let y = 0; y < Y; y++) {
+    const k = x*Y+y, p = 4*(y*X+x), v = 255-occ[k];
+    const c = st[k] == 3 ? [40, 180, 60] : st[k] == 2 ? [60, 60, 60] : [v, v, v];
+    img.data.set([c[0], c[1], c[2], 255], p);
+  }
+  const tmp = document.createElement("canvas"); tmp.width = X; tmp.height = Y;
+  tmp.getContext("2d").putImageData(img, 0, 0);
+  ctx.imageSmoothingEnabled = false; ctx.drawImage(tmp, 0, 0, X*scale, Y*scale);
+  outflow.push(...f.outflow); outflow.splice(0, Math.max(0, outflow.length-flow.width));
+  const fc = flow.getContext("2d"), top = Math.max(1, ...outflow);
+  fc.clearRect(0, 0, flow.width, flow.height); fc.fillStyle = "#246";
+  outflow.forEach((n, i) => fc.fillRect(i, flow.height*(1-n/top), 1, flow.height*n/top));
+  document.getElementById("info").textContent = (f.label ? f.label+"  " : "") +
+    "tick " + f.tick + "  time " + f.time.toFixed(1) + "  remaining " + f.remaining +
+    "  exited " + f.exited + "  conflicts " + f.conflicts + " (refused " + f.refused +
+    ")  dropped frames " + f.dropped;
+  document.getElementById("profiling").textContent = f.profiling ? JSON.stringify(f.profiling, null, 1) : "";
+}
+function connect() {
+  const ws = new WebSocket("ws://" + location.host + "/ws");
+  ws.onmessage = e => draw(JSON.parse(e.data));
+  ws.onclose = () => { document.getElementById("info").textContent = "disconnected"; setTimeout(connect, 1000); };
+}
+connect();
+</script></body></html>
+"""
+
+
+def main(argv=None):
+    from evac import Room, populate
+    from rng import CounterRNG
+    parser = argparse.ArgumentParser(description="Run a room and watch it at http://127.0.0.1:PORT/.")
+    parser.add_argument("--n-agents", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--layout", help="text map, image or .npz, see layout.py")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds between two ticks")
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args(argv)
+    if args.layout:
+        import layout
+        room = layout.load(args.layout).build_room()
+        room.rng = CounterRNG(args.seed)
+        if not room.get_agents():
+            layout.populate(room, args.n_agents)
+    else:
+        room = Room()
+        room.rng = CounterRNG(args.seed)
+        room.initialize_cells()
+        populate(room, args.n_agents)
+    if args.profile:
+        room.enable_profiling()
+    with Monitor(port=args.port, fps=args.fps) as monitor:
+        monitor.watch(room)
+        print("watching on", monitor.url())
+        while room.scheduler:
+            room.update_cells()
+            time.sleep(args.delay)
+        monitor.push(room)
+        print("evacuated at t=%.1f, Ctrl-C to stop" % room.time)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
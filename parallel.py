@@ -0,0 +1,401 @@
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import kernel
+from checkpoint import snapshot
+from evac import Room, populate
+from rng import DECIDE, PICK, REFUSE, CounterRNG
+
+# One room stepped by several processes. The grid is cut into strips of
+# columns, each owned by a worker process; the state lives in shared memory
+# and every worker only writes:
+#   - the decisions and bindings of the agents of its strip;
+#   - the moves into the cells of its strip (the agent may come from the
+#     halo of a neighbour strip).
+# A tick is a sequence of phases separated by barriers (the main process
+# waits for every worker): decide, solve the requested cells, then one
+# phase per level of the blocked chains, then finish. Between two phases a
+# worker reads the columns of its neighbours next to its border (the halo,
+# 2 columns because an agent next to an exit can jump 2 cells).
+# Draws are keyed by (tick, cell) (rng.py), so the run is the same as the
+# serial ensemble.Ensemble with one replica, whatever the number of strips.
+#   python parallel.py --size 1000 1000 --n-agents 200000 --processes 4
+
+HALO = 2
+NO_BINDING = -1
+NO_TARGET = -1
+
+# name -> (dtype, shape of one cell)
+FIELDS = {
+    "types": (np.int8, ()),
+    "next_update": (np.float64, ()),
+    "predicted_direction": (np.int8, (2,)),
+    "prediction": (np.int16, ()),
+    "bound_to": (np.int64, ()),  # flat index of the cell the agent waits for
+    "target": (np.int64, ()),  # free cell requested this tick
+    "walls": (np.bool_, ()),
+    "potential": (np.float64, ()),  # -potential_strength*distance
+    "nearest_exit": (np.int64, (2,)),
+    "shortcut": (np.bool_, ()),  # FloorField.exit_shortcut
+}
+
+
+class Strip:
+    # Worker side: columns x0 <= x < x1 of the grid.
+
+    def __init__(self, arrays, x0, x1, params):
+        self.__dict__.update(arrays)
+        self.dimX, self.dimY = self.types.shape
+        self.x0, self.x1 = x0, x1
+        self.alpha, self.beta, self.gamma, self.mu = params["coefficients"]
+        self.synchronous = params["synchronous"]
+        self.rng = CounterRNG(params["seed"])
+        self.first, self.end = x0*self.dimY, x1*self.dimY  # own flat indices
+        self.agents = np.flatnonzero(self.types[x0:x1].reshape(-1) == 1)+self.first
+        self.predicted_cells = np.zeros(0, dtype=np.int64)
+        self.cohort = np.zeros(0, dtype=np.int64)
+        self.arrived = []
+        self.tick = 0
+
+    def flat(self, name):
+        return getattr(self, name).reshape((self.dimX*self.dimY,)+FIELDS[name][1])
+
+    def own(self, cells):
+        return (cells >= self.first) & (cells < self.end)
+
+    def halo(self, field, width, empty):
+        # cells of the neighbour columns where `field` is not `empty`
+        cells = [np.zeros(0, dtype=np.int64)]
+        for x in list(range(max(0, self.x0-width), self.x0)) + \
+                list(range(self.x1, min(self.dimX, self.x1+width))):
+            cells.append(np.flatnonzero(getattr(self, field)[x] != empty)+x*self.dimY)
+        return np.concatenate(cells)
+
+    def clock(self):
+        # Predictions of the own cells, then the smallest clock of the strip.
+        prediction = self.flat("prediction")
+        prediction[self.predicted_cells] = 0
+        agents = np.concatenate([self.agents, self.halo("types", 1, 0)])
+        agents = agents[self.flat("types")[agents] == 1]
+        x, y = np.divmod(agents, self.dimY)
+        tX = x+self.predicted_direction[x, y, 0]
+        tY = y+self.predicted_direction[x, y, 1]
+        inside = (tX >= self.x0) & (tX < self.x1) & (tY >= 0) & (tY < self.dimY)
+        cells = tX[inside]*self.dimY+tY[inside]
+        np.add.at(prediction, cells, 1)
+        self.predicted_cells = cells
+        if not len(self.agents):
+            return np.inf
+        return float(self.flat("next_update")[self.agents].min())
+
+    def decide(self, now, tick):
+        self.tick = tick
+        target = self.flat("target")
+        target[self.cohort] = NO_TARGET
+        if self.synchronous:
+            self.cohort = self.agents.copy()
+        else:
+            self.cohort = self.agents[self.flat("next_update")[self.agents] == now]
+        if not len(self.cohort):
+            return 0
+        x, y = np.divmod(self.cohort, self.dimY)
+        agents = np.stack([x, y], axis=1)
+        draws = self.rng.uniforms(DECIDE, tick, self.cohort)
+        probs = kernel.transition_probabilities(
+            self.types, self.walls, self.potential, self.prediction, self.predicted_direction,
+            agents, self.alpha, self.beta, self.gamma)
+        directions = kernel.DIRECTIONS[kernel.inverse_cdf(probs, draws)]
+        directions = kernel.exit_override(directions, agents, self.nearest_exit, self.shortcut)
+        self.predicted_direction[x, y] = directions
+        bound_to = self.flat("bound_to")
+        bound_to[self.cohort] = NO_BINDING
+        a, b = x+directions[:, 0], y+directions[:, 1]
+        moving = (a != x) | (b != y)
+        goal = a*self.dimY+b
+        kind = self.types[a, b]
+        free = moving & ((kind == 0) | (kind == 3))
+        blocked = moving & (kind == 1)
+        bound_to[self.cohort[blocked]] = goal[blocked]
+        target[self.cohort[free]] = goal[free]
+        return len(self.cohort)
+
+    def requested(self):
+        # Round 0: the agents requesting a free cell of the strip.
+        target = self.flat("target")
+        sources = np.concatenate([self.cohort, self.halo("target", HALO, NO_TARGET)])
+        goals = target[sources]
+        keep = (goals != NO_TARGET) & self.own(goals)
+        return self.solve(sources[keep], goals[keep])
+
+    def chain(self, freed, last):
+        # The agents bound to the freed cells of the strip compete for them
+        # and lose their binding whatever happens.
+        bound_to = self.flat("bound_to")
+        x, y = np.divmod(freed, self.dimY)
+        nX = x[:, None]+kernel.DIRECTIONS[None, :, 0]
+        nY = y[:, None]+kernel.DIRECTIONS[None, :, 1]
+        inside = (nX >= 0) & (nX < self.dimX) & (nY >= 0) & (nY < self.dimY)
+        sources = (nX*self.dimY+nY)[inside]
+        goals = np.broadcast_to(freed[:, None], nX.shape)[inside]
+        hit = bound_to[sources] == goals
+        sources, goals = sources[hit], goals[hit]
+        bound_to[sources] = NO_BINDING
+        alive = self.flat("types")[sources] == 1
+        if last:
+            return np.zeros(0, dtype=np.int64), 0, 0, 0
+        return self.solve(sources[alive], goals[alive])
+
+    def solve(self, candidates, goals):
+        # Same rule as Ensemble.resolve_conflicts.
+        if not len(candidates):
+            return np.zeros(0, dtype=np.int64), 0, 0, 0
+        order = np.lexsort((self.rng.uniforms(PICK, self.tick, candidates), goals))
+        candidates, goals = candidates[order], goals[order]
+        cells, start, n = np.unique(goals, return_index=True, return_counts=True)
+        contested = n > 1
+        refused = contested & (self.rng.uniforms(REFUSE, self.tick, cells) <= self.mu)
+        keep = ~refused
+        exited = self.move_agents(candidates[start[keep]], cells[keep])
+        return candidates[start[keep]], exited, int(contested.sum()), int(refused.sum())
+
+    def move_agents(self, sources, targets):
+        types = self.flat("types")
+        clock = self.flat("next_update")
+        direction = self.flat("predicted_direction")
+        bound_to = self.flat("bound_to")
+        dX = targets//self.dimY-sources//self.dimY
+        dY = targets % self.dimY-sources % self.dimY
+        clock[targets] = clock[sources]+1+0.5*(np.abs(dX)+np.abs(dY) > 1)
+        types[sources] = 0
+        exits = types[targets] == 3
+        types[targets[~exits]] = 1
+        self.arrived.append(targets[~exits])
+        direction[sources] = (1, 0)
+        direction[targets] = (1, 0)
+        bound_to[sources] = NO_BINDING
+        bound_to[targets] = NO_BINDING
+        return int(exits.sum())
+
+    def finish(self, freed, now):
+        # Last level of the chains, agents who could not move are postponed,
+        # then the clock phase of the next tick.
+        if freed is not None:
+            self.chain(freed, True)
+        types = self.flat("types")
+        clock = self.flat("next_update")
+        if not self.synchronous:
+            stuck = self.cohort[(types[self.cohort] == 1) & (clock[self.cohort] == now)]
+            clock[stuck] += 1
+        self.agents = np.unique(np.concatenate([self.agents[types[self.agents] == 1]]+self.arrived))
+        self.arrived = []
+        return self.clock()
+
+
+def serve(conn, spec, x0, x1, params):
+    blocks, arrays = attach(spec)
+    strip = Strip(arrays, x0, x1, params)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, args = message
+        conn.send(getattr(strip, method)(*args))
+    arrays.clear()
+    for block in blocks:
+        block.close()
+
+
+def attach(spec):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+class Worker:
+
+    def __init__(self, spec, x0, x1, params):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child, spec, x0, x1, params),
+                                               daemon=True)
+        self.process.start()
+
+    def send(self, method, *args):
+        self.conn.send((method, args))
+
+    def recv(self):
+        return self.conn.recv()
+
+    def close(self):
+        self.conn.send(None)
+        self.process.join()
+
+
+class InlineWorker:
+    # Same interface, runs the strip in the main process (processes=0).
+
+    def __init__(self, spec, x0, x1, params):
+        self.blocks, arrays = attach(spec)
+        self.strip = Strip(arrays, x0, x1, params)
+
+    def send(self, method, *args):
+        self.result = getattr(self.strip, method)(*args)
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        self.strip = None
+        for block in self.blocks:
+            block.close()
+
+
+class ParallelRoom:
+
+    def __init__(self, room, processes=None, strips=None):
+        # Runs the current state of `room` (Room or ArrayRoom) over `strips`
+        # column strips, one process each (processes=0: no process).
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if strips is None:
+            strips = max(1, processes)
+        strips = min(strips, room.dimX)
+        self.dimX, self.dimY = room.dimX, room.dimY
+        self.max_depth = room.max_depth
+        self.synchronous = room.synchronous
+        self.tick = room.tick
+        self.time = room.time
+        self.exited = 0
+        self.conflicts = 0
+        self.refused = 0
+        self.blocks = []
+        self.arrays = {}
+        spec = {}
+        for name, (dtype, cell_shape) in FIELDS.items():
+            shape = (self.dimX, self.dimY)+cell_shape
+            block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))*np.dtype(dtype).itemsize))
+            self.blocks.append(block)
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            spec[name] = (block.name, shape, dtype)
+        ff = room.get_floor_field()
+        a = self.arrays
+        _, state = snapshot(room)
+        a["types"][:] = state["types"]
+        a["next_update"][:] = state["next_update"]
+        a["predicted_direction"][:] = state["predicted_direction"]
+        a["prediction"][:] = 0
+        a["bound_to"][:] = NO_BINDING
+        i, j, x, y = state["bindings"].T.astype(np.int64)
+        a["bound_to"].reshape(-1)[i*self.dimY+j] = x*self.dimY+y
+        a["target"][:] = NO_TARGET
+        a["walls"][:] = ff.walls
+        a["potential"][:] = ff.potential(room.potential_strength)
+        a["nearest_exit"][:] = ff.nearest_exit
+        a["shortcut"][:] = ff.exit_shortcut()
+        params = {"coefficients": (room.alpha, room.beta, room.gamma, room.mu),
+                  "seed": room.rng.seed, "synchronous": room.synchronous}
+        self.bounds = np.linspace(0, self.dimX, strips+1).astype(int)
+        cls = Worker if processes else InlineWorker
+        self.workers = [cls(spec, int(x0), int(x1), params)
+                        for x0, x1 in zip(self.bounds[:-1], self.bounds[1:])]
+        self.now = min(self.broadcast("clock"))
+
+    def broadcast(self, method, *args):
+        for w in self.workers:
+            w.send(method, *args)
+        return [w.recv() for w in self.workers]
+
+    def scatter(self, method, per_worker, *args):
+        for w, own in zip(self.workers, per_worker):
+            w.send(method, own, *args)
+        return [w.recv() for w in self.workers]
+
+    def split(self, results):
+        # freed cells of a phase, given to the worker owning them
+        self.exited += sum(r[1] for r in results)
+        self.conflicts += sum(r[2] for r in results)
+        self.refused += sum(r[3] for r in results)
+        freed = np.concatenate([r[0] for r in results])
+        owner = np.searchsorted(self.bounds, freed//self.dimY, side="right")-1
+        return [freed[owner == k] for k in range(len(self.workers))], len(freed)
+
+    def step(self):
+        if not np.isfinite(self.now):
+            return False
+        self.time = float(self.tick) if self.synchronous else self.now
+        self.broadcast("decide", self.now, self.tick)
+        freed, n = self.split(self.broadcast("requested"))
+        depth = 1
+        while n and (self.max_depth is None or depth < self.max_depth):
+            freed, n = self.split(self.scatter("chain", freed, False))
+            depth += 1
+        if n:
+            # the agents bound to the last freed cells lose their binding
+            self.now = min(self.scatter("finish", freed, self.now))
+        else:
+            self.now = min(self.broadcast("finish", None, self.now))
+        self.tick += 1
+        return True
+
+    def run(self, max_ticks=None):
+        ticks = 0
+        while (max_ticks is None or ticks < max_ticks) and self.step():
+            ticks += 1
+        return ticks
+
+    def get_types(self):
+        return self.arrays["types"].copy()
+
+    def remaining(self):
+        return int((self.arrays["types"] == 1).sum())
+
+    def close(self):
+        for w in self.workers:
+            w.close()
+        self.workers = []
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evacuation of a large room over several processes.")
+    parser.add_argument("--size", type=int, nargs=2, default=[1000, 1000])
+    parser.add_argument("--n-agents", type=int, default=200000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--strips", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=100)
+    parser.add_argument("--synchronous", action="store_true",
+                        help="every agent moves at every tick (parallel update)")
+    args = parser.parse_args(argv)
+    room = Room()
+    room.rng = CounterRNG(args.seed)
+    room.synchronous = args.synchronous
+    room.dimX, room.dimY = args.size
+    room.initialize_cells()
+    populate(room, args.n_agents)
+    with ParallelRoom(room, args.processes, args.strips) as proom:
+        start = time.perf_counter()
+        ticks = proom.run(args.max_ticks)
+        wall = time.perf_counter()-start
+        print("%d ticks in %.2f s (%.1f ticks/s), %d agents left, time %.1f" % (
+            ticks, wall, ticks/wall if wall else 0, proom.remaining(), proom.time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import time
+
+from evac import RoomListener
+
+# Optional instrumentation of a Room, see Room.enable_profiling. The timed
+# methods are installed on the instance only, a room without profiling runs
+# the plain class methods.
+
+PHASES = ("update_prediction", "get_agent_to_update", "choose_dirs",
+          "resolve_conflict", "move_agent")
+
+
+class RoomStats(RoomListener):
+
+    def __init__(self, callback=None):
+        self.callback = callback  # called as callback(room, stats) after every tick
+        self.time = {}  # seconds spent in each method since attach
+        self.calls = {}
+        self.tick_time = {}  # same, for the last tick only
+        self.max_depth = 0  # longest blocked chain moved by resolve_conflict
+        self.conflicts = 0
+        self.refused = 0  # conflicts where nobody moved (probability mu)
+        self.exited = 0
+        self.exited_last_tick = 0
+        self.ticks = 0
+        self.tick_exits = 0
+        self.wrapped = []
+
+    def wrap(self, obj, method):
+        f = getattr(obj, method)
+        total, calls, tick_time = self.time, self.calls, self.tick_time
+        total.setdefault(method, 0.0)
+        calls.setdefault(method, 0)
+        tick_time.setdefault(method, 0.0)
+        stats = self
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = f(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter()-start
+                total[method] += elapsed
+                tick_time[method] += elapsed
+                calls[method] += 1
+            if method == "resolve_conflict" and isinstance(result, int) and result > stats.max_depth:
+                stats.max_depth = result
+            return result
+        setattr(obj, method, timed)
+        self.wrapped.append((obj, method))
+
+    def attach(self, room):
+        for method in PHASES:
+            self.wrap(room, method)
+        room.listeners.append(self)
+
+    def detach(self, room):
+        for (obj, method) in self.wrapped:
+            delattr(obj, method)
+        self.wrapped = []
+        if self in room.listeners:
+            room.listeners.remove(self)
+
+    def on_move(self, i1, j1, i2, j2, exited):
+        if exited:
+            self.tick_exits += 1
+
+    def on_conflict(self, i, j, n, refused):
+        self.conflicts += 1
+        if refused:
+            self.refused += 1
+
+    def on_tick(self, room):
+        self.ticks += 1
+        self.exited += self.tick_exits
+        self.exited_last_tick = self.tick_exits
+        self.tick_exits = 0
+        if self.callback is not None:
+            self.callback(room, self)
+        for method in self.tick_time:
+            self.tick_time[method] = 0.0
+
+    def as_dict(self):
+        return {
+            "time": dict(self.time), "calls": dict(self.calls),
+            "max_depth": self.max_depth, "conflicts": self.conflicts,
+            "refused": self.refused, "exited": self.exited, "ticks": self.ticks,
+        }
+
+    def report(self):
+        lines = ["%-20s %10s %10s %12s" % ("phase", "calls", "seconds", "us/call")]
+        for method in self.time:
+            calls = self.calls[method]
+            lines.append("%-20s %10d %10.4f %12.2f" % (
+                method, calls, self.time[method], 1e6*self.time[method]/calls if calls else 0))
+        lines.append("ticks %d, exited %d, conflicts %d (refused %d), deepest chain %d" % (
+            self.ticks, self.exited, self.conflicts, self.refused, self.max_depth))
+        return "\n".join(lines)
@@ -0,0 +1,170 @@
+import json
+import os
+
+import numpy as np
+
+from evac import RoomListener
+
+# On-disk log of a run, written while the simulation goes so the history is
+# never held in memory. A run is a directory containing:
+#   meta.json      grid size and keyframe interval
+#   events.bin     one EVENT record per move, exit, conflict or cell change
+#   ticks.bin      for every state: offset of its first event and its time
+#   keyframes.bin  the full grid (int8 cell types) every keyframe_interval states
+# State t is the grid before tick t. TrajectoryReader memory-maps the files
+# and rebuilds any state from the closest keyframe.
+
+MOVE, EXIT, CONFLICT, REFUSED, SET = range(5)
+
+EVENT = np.dtype([("tick", "<u4"), ("kind", "u1"), ("i1", "<u2"), ("j1", "<u2"),
+                  ("i2", "<u2"), ("j2", "<u2"), ("n", "<u2")])
+TICK = np.dtype([("offset", "<u8"), ("time", "<f8")])
+
+
+class TrajectoryRecorder(RoomListener):
+
+    def __init__(self, path, keyframe_interval=100):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.events = []
+        self.n_events = 0
+        self.n_states = 0
+        self.previous = None
+        self.room = None
+        os.makedirs(path, exist_ok=True)
+        self.events_file = open(os.path.join(path, "events.bin"), "wb")
+        self.ticks_file = open(os.path.join(path, "ticks.bin"), "wb")
+        self.keyframes_file = open(os.path.join(path, "keyframes.bin"), "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_meta(self, dimX, dimY):
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"dimX": dimX, "dimY": dimY,
+                       "keyframe_interval": self.keyframe_interval}, f)
+
+    def add_state(self, types, time):
+        # Starts state n_states: flushes the events of the previous tick and
+        # writes a keyframe when it is due.
+        if self.events:
+            np.array(self.events, dtype=EVENT).tofile(self.events_file)
+            self.n_events += len(self.events)
+            self.events = []
+        np.array([(self.n_events, time)], dtype=TICK).tofile(self.ticks_file)
+        if self.n_states % self.keyframe_interval == 0:
+            np.ascontiguousarray(types, dtype=np.int8).tofile(self.keyframes_file)
+        self.n_states += 1
+
+    # Event driven recording of a Room
+
+    def attach(self, room):
+        self.room = room
+        self.write_meta(room.dimX, room.dimY)
+        room.listeners.append(self)
+        self.add_state(room.get_types(), room.time)
+
+    def on_move(self, i1, j1, i2, j2, exited):
+        self.events.append((self.n_states-1, EXIT if exited else MOVE, i1, j1, i2, j2, 0))
+
+    def on_conflict(self, i, j, n, refused):
+        self.events.append((self.n_states-1, REFUSED if refused else CONFLICT, i, j, 0, 0, n))
+
+    def on_set(self, i, j, t):
+        self.events.append((self.n_states-1, SET, i, j, 0, 0, t))
+
+    def on_tick(self, room):
+        types = room.get_types() if self.n_states % self.keyframe_interval == 0 else None
+        self.add_state(types, room.time)
+
+    # Frame driven recording, for models without events (main.py): only
+    # the cells that changed since the previous frame are written.
+
+    def add_frame(self, types, time=None):
+        types = np.asarray(types, dtype=np.int8)
+        if self.previous is None:
+            self.write_meta(*types.shape)
+        else:
+            for (i, j) in np.argwhere(types != self.previous):
+                self.events.append((self.n_states-1, SET, i, j, 0, 0, types[i, j]))
+        self.previous = types.copy()
+        self.add_state(types, self.n_states if time is None else time)
+
+    def close(self):
+        if self.room is not None and self in self.room.listeners:
+            self.room.listeners.remove(self)
+        # events of the last tick, without starting a new state
+        if self.events:
+            np.array(self.events, dtype=EVENT).tofile(self.events_file)
+            self.events = []
+        for f in (self.events_file, self.ticks_file, self.keyframes_file):
+            f.close()
+
+
+def memmap(path, dtype, shape=None):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class TrajectoryReader:
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.dimX = meta["dimX"]
+        self.dimY = meta["dimY"]
+        self.keyframe_interval = meta["keyframe_interval"]
+        self.events = memmap(os.path.join(path, "events.bin"), EVENT)
+        self.ticks = memmap(os.path.join(path, "ticks.bin"), TICK)
+        keyframes = memmap(os.path.join(path, "keyframes.bin"), np.int8)
+        self.keyframes = keyframes.reshape(-1, self.dimX, self.dimY)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def time_of(self, t):
+        return float(self.ticks[t]["time"])
+
+    def event_range(self, t):
+        start = int(self.ticks[t]["offset"])
+        end = int(self.ticks[t+1]["offset"]) if t+1 < len(self.ticks) else len(self.events)
+        return start, end
+
+    def events_of(self, t):
+        start, end = self.event_range(t)
+        return self.events[start:end]
+
+    def state_at(self, t):
+        if not 0 <= t < len(self):
+            raise IndexError(t)
+        k = t//self.keyframe_interval
+        types = np.array(self.keyframes[k])
+        start = self.event_range(k*self.keyframe_interval)[0]
+        end = self.event_range(t)[0]
+        apply_events(types, self.events[start:end])
+        return types
+
+    def __iter__(self):
+        types = None
+        for t in range(len(self)):
+            if t % self.keyframe_interval == 0:
+                types = np.array(self.keyframes[t//self.keyframe_interval])
+            else:
+                apply_events(types, self.events_of(t-1))
+            yield types
+
+
+def apply_events(types, events):
+    for e in events:
+        kind = e["kind"]
+        if kind == MOVE:
+            types[e["i1"], e["j1"]] = 0
+            types[e["i2"], e["j2"]] = 1
+        elif kind == EXIT:
+            types[e["i1"], e["j1"]] = 0
+        elif kind == SET:
+            types[e["i1"], e["j1"]] = e["n"]
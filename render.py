@@ -0,0 +1,192 @@
+import queue
+import threading
+
+from evac import RoomListener
+
+# Display of the grid. The image artist is created once and its data is
+# replaced at every frame, instead of a new plt.imshow per step.
+# matplotlib is only imported by the classes drawing something, importing
+# this module (for FrameTap, LatestFrame...) stays cheap.
+
+
+def to_image(types):
+    # same picture as get_array_to_display: x horizontal, agents in black
+    return 3-types.T
+
+
+def make_image(ax, types):
+    ax.set_axis_off()
+    return ax.imshow(to_image(types), cmap="binary", vmin=0, vmax=3,
+                     interpolation="nearest")
+
+
+class RoomView:
+    # Interactive window updated in place, with blitting when the backend
+    # supports it.
+
+    def __init__(self, types, pause=0.001):
+        import matplotlib.pyplot as plt
+        plt.ion()
+        self.pause = pause
+        self.fig, self.ax = plt.subplots()
+        self.image = make_image(self.ax, types)
+        self.blit = getattr(self.fig.canvas, "supports_blit", False)
+        self.image.set_animated(self.blit)
+        self.fig.canvas.draw()
+        if self.blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        plt.show(block=False)
+        self.update(types)
+
+    def update(self, types):
+        self.image.set_data(to_image(types))
+        canvas = self.fig.canvas
+        if self.blit:
+            canvas.restore_region(self.background)
+            self.ax.draw_artist(self.image)
+            canvas.blit(self.ax.bbox)
+            canvas.flush_events()
+        else:
+            import matplotlib.pyplot as plt
+            canvas.draw_idle()
+            plt.pause(self.pause)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.fig)
+
+
+class FrameWriter:
+    # Renders frames offscreen to a GIF (Pillow) or a video (ffmpeg) in a
+    # background thread. push() never blocks: when the writer is late, the
+    # stride doubles, every other queued frame is dropped and only one pushed
+    # frame in `stride` is kept from then on, so the frames written stay
+    # evenly spread over the whole run. Dropped frames are counted in
+    # self.dropped.
+
+    def __init__(self, path, fps=20, dpi=100, maxsize=64):
+        self.path = path
+        self.fps = fps
+        self.dpi = dpi
+        self.frames = queue.Queue(maxsize)
+        self.stride = 1
+        self.pushed = 0
+        self.dropped = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def push(self, types):
+        index = self.pushed
+        self.pushed += 1
+        while index % self.stride == 0:
+            try:
+                self.frames.put_nowait((index, types.copy()))
+                return
+            except queue.Full:
+                self.decimate()
+        self.dropped += 1
+
+    def decimate(self):
+        # only the queued frames whose index is a multiple of the new stride
+        # are kept
+        self.stride *= 2
+        queued = []
+        try:
+            while True:
+                queued.append(self.frames.get_nowait())
+        except queue.Empty:
+            pass
+        for index, types in queued:
+            if index % self.stride:
+                self.dropped += 1
+            else:
+                self.frames.put_nowait((index, types))
+
+    def run(self):
+        from matplotlib import animation
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        frame = self.frames.get()
+        if frame is None:
+            return
+        # pyplot is not thread safe, the figure is built without it
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        image = make_image(fig.add_subplot(), frame[1])
+        if self.path.endswith(".gif"):
+            writer = animation.PillowWriter(fps=self.fps)
+        else:
+            writer = animation.FFMpegWriter(fps=self.fps)
+        with writer.saving(fig, self.path, self.dpi):
+            while frame is not None:
+                image.set_data(to_image(frame[1]))
+                writer.grab_frame()
+                self.written += 1
+                frame = self.frames.get()
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+
+
+class LatestFrame:
+    # Holds the last grid produced by the simulation, for a viewer that
+    # refreshes at its own pace.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = None
+        self.version = 0
+
+    def push(self, types):
+        types = types.copy()
+        with self.lock:
+            self.types = types
+            self.version += 1
+
+    def get(self):
+        with self.lock:
+            return self.version, self.types
+
+
+class FrameTap(RoomListener):
+    # Sends the grid to a FrameWriter or a LatestFrame every `every` ticks.
+
+    def __init__(self, sink, every=1):
+        self.sink = sink
+        self.every = every
+
+    def on_tick(self, room):
+        if room.tick % self.every == 0:
+            self.sink.push(room.get_types())
+
+
+class TkViewer:
+    # Shows a LatestFrame in a Tkinter window at a fixed frame rate. The
+    # simulation runs in another thread and is never waited for.
+
+    def __init__(self, root, frames, fps=25):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        self.root = root
+        self.frames = frames
+        self.interval = max(1, int(1000/fps))
+        self.version = -1
+        self.fig = Figure()
+        self.ax = self.fig.add_subplot()
+        self.image = None
+        self.canvas = FigureCanvasTkAgg(self.fig, master=root)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.root.after(self.interval, self.refresh)
+
+    def refresh(self):
+        version, types = self.frames.get()
+        if types is not None and version != self.version:
+            self.version = version
+            if self.image is None:
+                self.image = make_image(self.ax, types)
+            else:
+                self.image.set_data(to_image(types))
+            self.canvas.draw_idle()
+        self.root.after(self.interval, self.refresh)
@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+
+# Counter-based random numbers. A draw is a hash of (seed, purpose, counter,
+# key) instead of the next value of a shared stream, so it does not depend
+# on the order in which the agents are processed nor on how the work is
+# split between replicas or processes. The models use the tick as counter
+# and a cell (i*dimY+j) as key: within a tick each key is used at most once
+# per purpose.
+
+DECIDE = 1  # direction chosen by the agent of the cell
+REFUSE = 2  # nobody moves into the requested cell (probability mu)
+PICK = 3  # the candidate with the smallest draw wins the cell
+PLACE = 4  # initial positions, the n free cells with the smallest draws
+
+MASK = 2**64-1
+GOLDEN = 0x9E3779B97F4A7C15
+M1 = 0xBF58476D1CE4E5B9
+M2 = 0x94D049BB133111EB
+TO_FLOAT = 2.0**-53
+
+
+def mix(z):
+    # splitmix64 finalizer, on Python ints
+    z = (z+GOLDEN) & MASK
+    z = ((z ^ (z >> 30))*M1) & MASK
+    z = ((z ^ (z >> 27))*M2) & MASK
+    return z ^ (z >> 31)
+
+
+def mix_array(z):
+    # same on uint64 arrays, the products wrap around like the & MASK above
+    with np.errstate(over="ignore"):
+        z = z+np.uint64(GOLDEN)
+        z = (z ^ (z >> np.uint64(30)))*np.uint64(M1)
+        z = (z ^ (z >> np.uint64(27)))*np.uint64(M2)
+        return z ^ (z >> np.uint64(31))
+
+
+class CounterRNG:
+
+    def __init__(self, seed=None):
+        # Without a seed, one is taken from the random module, so that
+        # random.seed() still makes a run reproducible.
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = int(seed) & MASK
+
+    def uniform(self, purpose, counter, key):
+        h = mix(mix(mix(self.seed ^ purpose) ^ counter) ^ key)
+        return (h >> 11)*TO_FLOAT
+
+    def uniforms(self, purpose, counter, keys):
+        # uniform() for arrays of keys (and counters), in one block
+        base = np.uint64(mix(self.seed ^ purpose))
+        counter = np.asarray(counter, dtype=np.uint64)
+        keys = np.asarray(keys, dtype=np.uint64)
+        h = mix_array(mix_array(base ^ counter) ^ keys)
+        return (h >> np.uint64(11)).astype(np.float64)*TO_FLOAT
+
+
+def inverse_cdf(weights, u):
+    # Index drawn from unnormalized weights with the uniform u, the same
+    # rule as kernel.inverse_cdf.
+    threshold = u*sum(weights)
+    total = 0
+    for k, w in enumerate(weights):
+        total += w
+        if total > threshold:
+            return k
+    return len(weights)-1
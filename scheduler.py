@@ -0,0 +1,74 @@
+import heapq
+
+# Priority queue of the agents keyed by their next_update time, so the next
+# cohort of active agents is found without rescanning the grid.
+# Agents are identified by the cell they occupy. Entries are invalidated
+# lazily: a moved or removed agent leaves a stale entry in the heap which is
+# skipped when it reaches the top.
+
+
+class AgentScheduler:
+
+    def __init__(self, agents=()):
+        self.entries = {}  # cell -> (time, sequence number) of its valid entry
+        self.counter = 0
+        self.heap = []
+        for (cell, t) in agents:
+            self.counter += 1
+            self.entries[cell] = (t, self.counter)
+            self.heap.append((t, self.counter, cell))
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, cell):
+        return cell in self.entries
+
+    def time_of(self, cell):
+        return self.entries[cell][0]
+
+    def add(self, cell, t):
+        self.counter += 1
+        self.entries[cell] = (t, self.counter)
+        heapq.heappush(self.heap, (t, self.counter, cell))
+
+    def remove(self, cell):
+        self.entries.pop(cell, None)
+
+    def move(self, src, dst, t):
+        self.remove(src)
+        self.add(dst, t)
+
+    def is_valid(self, entry):
+        t, seq, cell = entry
+        return self.entries.get(cell) == (t, seq)
+
+    def drop_stale(self):
+        while self.heap and not self.is_valid(self.heap[0]):
+            heapq.heappop(self.heap)
+        # The heap only keeps a bounded amount of garbage.
+        if len(self.heap) > 4*len(self.entries)+64:
+            self.heap = [(t, seq, cell) for cell, (t, seq) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def peek_time(self):
+        self.drop_stale()
+        if not self.heap:
+            return float("inf")
+        return self.heap[0][0]
+
+    def peek_cohort(self):
+        # Every agent sharing the smallest next_update, in grid order. The
+        # agents stay scheduled: those who move are rescheduled by move().
+        t = self.peek_time()
+        if t == float("inf"):
+            return t, []
+        popped = []
+        while self.heap and self.heap[0][0] == t:
+            entry = heapq.heappop(self.heap)
+            if self.is_valid(entry):
+                popped.append(entry)
+        for entry in popped:
+            heapq.heappush(self.heap, entry)
+        return t, sorted(cell for (_, _, cell) in popped)
@@ -0,0 +1,25 @@
+from evac import populate
+from rng import CounterRNG
+
+# Rooms and runs shared by the tests: a small room (26x14 by default) with
+# agents placed by populate, then the grid and the counters after every tick.
+
+
+def make_room(cls, seed, n=80, synchronous=False, dims=(26, 14), **parameters):
+    room = cls()
+    room.dimX, room.dimY = dims
+    room.rng = CounterRNG(seed)
+    room.synchronous = synchronous
+    for name, value in parameters.items():
+        setattr(room, name, value)
+    room.initialize_cells()
+    populate(room, n)
+    return room
+
+
+def run(room, ticks=2000):
+    states = []
+    while room.scheduler and len(states) < ticks:
+        room.update_cells()
+        states.append((room.get_types().tolist(), room.time, room.conflicts, room.refused))
+    return states
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from analytics import FlowStats, Series
+from evac import Room
+from helpers import make_room
+
+
+@pytest.mark.parametrize("bins", [1, 2, 5, 8])
+def test_series_merges_windows(bins):
+    series = Series(("x",), bins=bins)
+    for t in range(100):
+        series.add("x", t+0.5, 1)
+    d = series.as_dict()
+    assert d["x"].sum() == 100
+    assert len(d["x"]) <= bins
+    assert d["width"]*bins >= 100
+    # every full window holds `width` unit values
+    assert (d["x"][:-1] == d["width"]).all()
+
+
+def test_flow_stats_totals():
+    room = make_room(Room, 0, n=50)
+    stats = FlowStats(window=0.5, bins=7).attach(room)
+    while room.scheduler:
+        room.update_cells()
+    summary = stats.summary()
+    assert summary["exited"] == 50
+    assert np.isclose(summary["flow"].sum()*summary["window"], 50)
+    assert len(summary["evacuation_times"]) == 50
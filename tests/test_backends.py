@@ -0,0 +1,58 @@
+import pytest
+
+from array_room import ArrayRoom
+from ensemble import Ensemble
+from evac import Room
+from helpers import make_room, run
+from parallel import ParallelRoom
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("gamma", [0.2, 0.9])
+def test_room_and_array_room_agree(seed, gamma):
+    # gamma=0.9 gives negative (1-gamma*r) factors, clamped to 0 by both
+    expected, got = [run(make_room(cls, seed, gamma=gamma)) for cls in (Room, ArrayRoom)]
+    assert expected == got
+
+
+def test_room_and_array_room_agree_far_from_the_exit():
+    # exp(alpha*u) underflows to 0 beyond about 248 cells from the exit
+    expected, got = [run(make_room(cls, 0, n=200, dims=(300, 30)), 200) for cls in (Room, ArrayRoom)]
+    assert expected == got
+    # the agents of the far end walk towards the exit
+    types, _, _, _ = expected[-1]
+    assert not any(1 in column for column in types[:5])
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_synchronous_backends_match(seed):
+    reference = make_room(ArrayRoom, seed, synchronous=True)
+    ensemble = Ensemble(make_room(ArrayRoom, seed, synchronous=True), 2)
+    with ParallelRoom(make_room(Room, seed, synchronous=True), 0, 3) as room:
+        while reference.scheduler:
+            reference.update_cells()
+            ensemble.step()
+            room.step()
+            assert (reference.types == ensemble.types[0]).all()
+            assert (reference.types == room.arrays["types"]).all()
+            assert reference.time == ensemble.time[0] == room.time
+        assert not room.remaining()
+
+
+@pytest.mark.parametrize("cls", [Room, ArrayRoom])
+def test_synchronous_heap_stays_bounded(cls):
+    room = make_room(cls, 0, n=100, synchronous=True)
+    while room.scheduler and room.tick < 200:
+        agents = len(room.scheduler)
+        room.update_cells()
+        # compacted before the tick, at most one push per agent during it
+        assert len(room.scheduler.heap) <= 5*agents+64
+
+
+@pytest.mark.parametrize("synchronous", [False, True])
+def test_run_until_stops_when_the_room_is_empty(synchronous):
+    room = make_room(Room, 0, n=0, synchronous=synchronous)
+    assert room.run_until(float("inf"), max_ticks=50) == 0
+    room = make_room(Room, 0, n=20, synchronous=synchronous)
+    ticks = room.run_until(float("inf"), max_ticks=5000)
+    assert not room.scheduler and ticks == room.tick < 5000
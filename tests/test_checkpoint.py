@@ -0,0 +1,19 @@
+import pytest
+
+import checkpoint
+from array_room import ArrayRoom
+from evac import Room
+from helpers import make_room, run
+
+
+@pytest.mark.parametrize("synchronous", [False, True])
+@pytest.mark.parametrize("cls", [Room, ArrayRoom])
+def test_restore_continues_identically(cls, synchronous, tmp_path):
+    room = make_room(cls, 3, synchronous=synchronous)
+    run(room, 40)
+    path = str(tmp_path/"run.ckpt")
+    checkpoint.save(room, path)
+    expected = run(room)
+    restored = checkpoint.restore(path)
+    assert type(restored) is cls and restored.synchronous == synchronous
+    assert run(restored) == expected
@@ -0,0 +1,56 @@
+import pytest
+
+import layout
+from array_room import ArrayRoom
+from evac import Room, RoomListener
+from floor_field import ANISOTROPIC, OBSTACLE
+from rng import CounterRNG
+
+WALLED_EXIT = """\
+#######
+#.....#
+#.....#
+#...A#E
+#.....#
+#######
+"""
+
+
+class Moves(RoomListener):
+
+    def __init__(self):
+        self.moves = []
+
+    def on_move(self, i1, j1, i2, j2, exited):
+        self.moves.append((i1, j1, i2, j2))
+
+
+@pytest.mark.parametrize("mode", [ANISOTROPIC, OBSTACLE])
+@pytest.mark.parametrize("cls", [Room, ArrayRoom])
+def test_no_exit_shortcut_through_a_wall(cls, mode):
+    room = layout.from_ascii(WALLED_EXIT, mode).build_room(cls)
+    assert not room.get_floor_field().exit_shortcut()[4, 3]
+    moves = Moves()
+    room.listeners.append(moves)
+    while room.scheduler and room.tick < 200:
+        room.update_cells()
+    # the exit is only reached from (5, 2) or (5, 4), never across the wall
+    assert room.exited == 1
+    assert all(abs(i2-i1) <= 1 and abs(j2-j1) <= 1 for (i1, j1, i2, j2) in moves.moves)
+
+
+def test_exit_shortcut_next_to_an_exit():
+    room = layout.from_ascii(WALLED_EXIT.replace("A#E", "A.E")).build_room()
+    assert room.get_floor_field().exit_shortcut()[4, 3]
+    assert room.choose_dir(4, 3) == (2, 0)
+
+
+def test_populate_keeps_the_layout_geometry():
+    plan = layout.from_ascii("#########\n#.......#\n#.......E\n#.......#\n#########\n")
+    room = plan.build_room()
+    room.rng = CounterRNG(0)
+    layout.populate(room, 10)
+    types = room.get_types()
+    assert (types == 1).sum() == len(room.scheduler) == 10
+    assert ((types == 2) == (plan.types == 2)).all()
+    assert ((types == 3) == (plan.types == 3)).all()
@@ -0,0 +1,22 @@
+import pytest
+
+import main
+from rng import CounterRNG
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_blocker_index_matches_bindings(seed):
+    piece = main.room()
+    piece.rng = CounterRNG(seed)
+    main.populate(piece, 40)
+    piece.cells[piece.sortie].n = 3
+    for _ in range(2000):
+        if not any(c.n == 1 for c in piece.cells.values()):
+            break
+        piece.update_cells()
+        for k, c in piece.cells.items():
+            # no duplicate, every entry is bound to this cell and back
+            assert len(set(c.is_blocker_of)) == len(c.is_blocker_of)
+            assert all(piece.cells[f].bound_to == [k] for f in c.is_blocker_of)
+            assert all(k in piece.cells[b].is_blocker_of for b in c.bound_to)
+    assert not any(c.n == 1 for c in piece.cells.values())
@@ -0,0 +1,21 @@
+import pytest
+
+from ensemble import Ensemble
+from evac import Room
+from helpers import make_room
+from parallel import ParallelRoom
+
+
+@pytest.mark.parametrize("strips,processes", [(1, 0), (3, 0), (5, 0), (2, 2), (4, 2)])
+def test_parallel_room_matches_ensemble_replica_0(strips, processes):
+    ensemble = Ensemble(make_room(Room, 1), 1)
+    with ParallelRoom(make_room(Room, 1), processes, strips) as room:
+        while True:
+            running = ensemble.step()
+            assert room.step() == running
+            if not running:
+                break
+            assert (room.arrays["types"] == ensemble.types[0]).all()
+            assert room.time == ensemble.time[0]
+        assert room.conflicts == ensemble.conflicts[0]
+
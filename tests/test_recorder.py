@@ -0,0 +1,25 @@
+import pytest
+
+from array_room import ArrayRoom
+from evac import Room
+from helpers import make_room
+from recorder import TrajectoryReader, TrajectoryRecorder
+
+
+@pytest.mark.parametrize("cls", [Room, ArrayRoom])
+def test_replay_after_closing_an_exit(cls, tmp_path):
+    room = make_room(cls, 3, n=60)
+    exits = [(int(i), int(j)) for (i, j) in zip(*(room.get_types() == 3).nonzero())]
+    expected = []
+    with TrajectoryRecorder(str(tmp_path/"run"), keyframe_interval=7) as recorder:
+        recorder.attach(room)
+        expected.append(room.get_types())
+        while room.scheduler and room.tick < 300:
+            if room.tick == 10:
+                room.set_cell_type(*exits[0], 2)
+            room.update_cells()
+            expected.append(room.get_types())
+    reader = TrajectoryReader(str(tmp_path/"run"))
+    assert len(reader) == len(expected)
+    for t, types in enumerate(expected):
+        assert (reader.state_at(t) == types).all()
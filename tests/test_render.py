@@ -0,0 +1,24 @@
+import numpy as np
+
+from render import FrameWriter
+
+
+class StalledWriter(FrameWriter):
+    # nothing is written: the queue fills up at once
+
+    def run(self):
+        pass
+
+
+def test_frame_writer_drops_frames_evenly():
+    writer = StalledWriter("unused.gif", maxsize=8)
+    for t in range(200):
+        writer.push(np.array([t]))
+    kept = []
+    while not writer.frames.empty():
+        kept.append(int(writer.frames.get_nowait()[1][0]))
+    assert writer.dropped+len(kept) == 200
+    # evenly spaced over the whole run, the last frames included
+    assert len(kept) > 4
+    assert len(set(np.diff(kept))) == 1
+    assert kept[-1] >= 200-writer.stride
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from array_room import ArrayRoom
+from ensemble import Ensemble
+from evac import Room
+from helpers import make_room
+from rng import DECIDE, PICK, PLACE, REFUSE, CounterRNG
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2**63+5, 2**64-1])
+@pytest.mark.parametrize("purpose", [DECIDE, REFUSE, PICK, PLACE])
+def test_uniform_and_uniforms_agree(seed, purpose):
+    # Room draws one value at a time, Ensemble and ParallelRoom in blocks
+    rng = CounterRNG(seed)
+    keys = np.array([0, 1, 2, 363, 2**32+7, 2**64-1], dtype=np.uint64)
+    for counter in (0, 1, 1000, 2**40+3):
+        block = rng.uniforms(purpose, counter, keys)
+        assert block.tolist() == [rng.uniform(purpose, counter, int(k)) for k in keys]
+        assert ((block >= 0) & (block < 1)).all()
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("cls", [Room, ArrayRoom])
+def test_ensemble_replica_0_follows_the_room(cls, seed):
+    reference = make_room(cls, seed)
+    ensemble = Ensemble(make_room(cls, seed), 3)
+    while reference.scheduler:
+        reference.update_cells()
+        ensemble.step()
+        assert (reference.get_types() == ensemble.types[0]).all()
+        assert reference.time == ensemble.time[0]
+    assert reference.conflicts == ensemble.conflicts[0]
+    assert reference.refused == ensemble.refused[0]
+    assert ensemble.remaining()[0] == 0